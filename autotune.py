@@ -0,0 +1,173 @@
+from typing import Any
+from dataclasses import dataclass
+from io import TextIOWrapper
+import itertools
+import os
+from pathlib import Path
+import time
+
+import click
+
+from experiments.click_options import State, extra_vars_option, pass_state
+from experiments.utils import load_config
+
+
+@dataclass
+class Trial:
+    params: dict[str, int]
+    rows_per_second: float = 0.0
+    memory_mb: float = 0.0
+    error: str | None = None
+
+    @property
+    def extra_vars(self) -> str:
+        return ",".join(f"{k}={v}" for k, v in self.params.items())
+
+
+@click.command(
+    help=(
+        "Search batch size, DataLoader workers, prefetch factor and torch threads "
+        "with the highest training throughput and print them as extra vars. "
+        "Batch size changes optimization, so check metrics after tuning."
+    ),
+    context_settings={"help_option_names": ["-h", "--help"]},
+)
+@click.option(
+    "--config-path",
+    help="Config path.",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    default=Path.cwd() / "configs/train.yaml.j2",
+    show_default=True,
+)
+@click.option("--batch-sizes", type=click.STRING, default="8,16,32,64,128", show_default=True)
+@click.option("--num-workers", type=click.STRING, default="0,1,2,4", show_default=True)
+@click.option("--prefetch-factors", type=click.STRING, default="2,4", show_default=True)
+@click.option(
+    "--num-threads",
+    type=click.STRING,
+    default=None,
+    help="Comma separated numbers of torch threads. Powers of two up to CPU count by default.",
+)
+@click.option("--steps", type=click.INT, default=50, show_default=True, help="Timed steps.")
+@click.option("--warmup", type=click.INT, default=5, show_default=True)
+@click.option(
+    "--memory-limit-mb",
+    type=click.FLOAT,
+    default=None,
+    help="Skip settings that use more memory (PSS of the process and workers).",
+)
+@click.option(
+    "-o",
+    "--out",
+    type=click.File("w", encoding="utf-8"),
+    help="Where to write extra vars of the best setting. By default prints to stdout.",
+    default="-",
+)
+@extra_vars_option
+@pass_state
+def main(
+    state: State,
+    config_path: Path,
+    batch_sizes: str,
+    num_workers: str,
+    prefetch_factors: str,
+    num_threads: str | None,
+    steps: int,
+    warmup: int,
+    memory_limit_mb: float | None,
+    out: TextIOWrapper,
+) -> None:
+    from loguru import logger
+
+    trials = []
+    for params in search_space(batch_sizes, num_workers, prefetch_factors, num_threads):
+        config = load_config(config_path, extra_vars=(state.extra_vars or {}) | params)
+        trial = run_trial(config, Trial(params), steps=steps, warmup=warmup)
+        trials.append(trial)
+        logger.info(
+            f"autotune: {trial.extra_vars} -> {trial.rows_per_second:.1f} rows/s, "
+            f"{trial.memory_mb:.1f}MB" + (f" ({trial.error})" if trial.error else "")
+        )
+    fitting = [
+        t
+        for t in trials
+        if t.error is None and (memory_limit_mb is None or t.memory_mb <= memory_limit_mb)
+    ]
+    if len(fitting) == 0:
+        raise click.ClickException("No setting fits the memory limit")
+    best = max(fitting, key=lambda t: t.rows_per_second)
+    logger.info(f"autotune: best {best.extra_vars} with {best.rows_per_second:.1f} rows/s")
+    out.write(best.extra_vars + "\n")
+
+
+def search_space(
+    batch_sizes: str, num_workers: str, prefetch_factors: str, num_threads: str | None
+) -> list[dict[str, int]]:
+    if num_threads is None:
+        cpu_count = os.cpu_count() or 1
+        num_threads = ",".join(
+            str(2**i) for i in range(cpu_count.bit_length()) if 2**i <= cpu_count
+        )
+    space = []
+    for batch_size, workers, factor, threads in itertools.product(
+        *(map(int, v.split(",")) for v in (batch_sizes, num_workers, prefetch_factors, num_threads))
+    ):
+        params = {"batch_size": batch_size, "num_workers": workers, "num_threads": threads}
+        if workers > 0:
+            params["prefetch_factor"] = factor
+        if params not in space:
+            space.append(params)
+    return space
+
+
+def run_trial(config: dict[str, Any], trial: Trial, steps: int, warmup: int) -> Trial:
+    """Train for warmup + steps batches of the train dataset and measure throughput."""
+    from hydra.utils import instantiate
+    import torch
+
+    from experiments.memory import children_memory, process_memory
+
+    torch.set_num_threads(trial.params["num_threads"])
+    loader_config = {
+        k: v
+        for k, v in config["datasets"]["train"].items()
+        if k not in ("max_iters", "prefetch", "preload")
+    }
+    model = instantiate(config["model"])
+    optimizer = instantiate(config["optimizer"])(model.parameters())
+    loader = instantiate(loader_config)
+    model.train()
+    rows, start = 0, time.perf_counter()
+    batches = _cycle(loader)
+    try:
+        for step in range(warmup + steps):
+            if step == warmup:
+                rows, start = 0, time.perf_counter()
+            batch = next(batches)
+            loss = model(batch)["loss"]
+            loss.backward()
+            optimizer.step()
+            optimizer.zero_grad()
+            rows += batch["target"].size(0)
+        trial.rows_per_second = rows / (time.perf_counter() - start)
+        # Workers are still alive here as the loader iterator is not exhausted.
+        trial.memory_mb = process_memory().pss + sum(w.pss for w in children_memory())
+    except Exception as e:  # noqa: BLE001
+        trial.error = f"{type(e).__name__}: {e}"
+    finally:
+        batches.close()
+    return trial
+
+
+def _cycle(loader: Any) -> Any:
+    while True:
+        empty = True
+        for batch in loader:
+            empty = False
+            yield batch
+        if empty:
+            raise ValueError("loader is empty")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import json
+from pathlib import Path
+import subprocess
+import sys
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def make_dataset(
+    dir: Path, n_samples: int = 100_000, n_features: int = 50, n_classes: int = 2, seed: int = 13
+) -> Path:
+    """Generate a synthetic dataset with scripts/gen_dataset.py and split it like README does."""
+    dir.mkdir(parents=True, exist_ok=True)
+    full_dataset = dir / "full-dataset.jsonl"
+    subprocess.run(
+        [  # noqa: S603
+            sys.executable,
+            str(ROOT / "scripts" / "gen_dataset.py"),
+            f"--n-samples={n_samples}",
+            f"--n-features={n_features}",
+            f"--n-classes={n_classes}",
+            f"--seed={seed}",
+            f"--out={full_dataset}",
+        ],
+        check=True,
+    )
+    with (
+        full_dataset.open("r", encoding="utf-8") as file,
+        (dir / "train.jsonl").open("w", encoding="utf-8") as train,
+        (dir / "eval.jsonl").open("w", encoding="utf-8") as eval,
+        (dir / "eval-no-target.jsonl").open("w", encoding="utf-8") as eval_no_target,
+    ):
+        for line in file:
+            sample = json.loads(line)
+            if sample.pop("part") == "train":
+                train.write(json.dumps(sample) + "\n")
+                continue
+            eval.write(json.dumps(sample) + "\n")
+            sample.pop("target")
+            eval_no_target.write(json.dumps(sample) + "\n")
+    return dir
@@ -0,0 +1,71 @@
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+from benchmarks.data import ROOT, make_dataset
+
+
+def run_train(num_processes: int, extra_vars: str, workdir: Path) -> float:
+    cmd = [
+        sys.executable,
+        "-m",
+        "torch.distributed.run",
+        "--standalone",
+        f"--nproc_per_node={num_processes}",
+        "train.py",
+        "--no-mlflow",
+        "--force",
+        f"--dir={workdir / f'model-{num_processes}'}",
+        f"--cache-dir={workdir / 'cache'}",
+        f"--extra-vars={extra_vars}",
+    ]
+    start = time.perf_counter()
+    subprocess.run(cmd, cwd=ROOT, check=True, capture_output=True)  # noqa: S603
+    return time.perf_counter() - start
+
+
+@click.command(
+    help="Measure scaling of train.py with several local CPU processes.",
+    context_settings={"help_option_names": ["-h", "--help"]},
+)
+@click.option(
+    "--num-processes",
+    type=click.STRING,
+    default="1,2,4",
+    show_default=True,
+    help="Comma separated numbers of processes to try.",
+)
+@click.option("--n-samples", type=click.INT, default=100_000, show_default=True)
+@click.option("--n-features", type=click.INT, default=50, show_default=True)
+@click.option("--epochs", type=click.INT, default=2, show_default=True)
+@click.option("--batch-size", type=click.INT, default=64, show_default=True)
+def main(
+    num_processes: str,
+    n_samples: int = 100_000,
+    n_features: int = 50,
+    epochs: int = 2,
+    batch_size: int = 64,
+) -> None:
+    # dvc.Iter reads files from the repository workspace only.
+    (ROOT / "data").mkdir(exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=ROOT / "data") as tmpdir:
+        datasets = make_dataset(Path(tmpdir), n_samples=n_samples, n_features=n_features)
+        extra_vars = (
+            f"datasets={datasets.relative_to(ROOT)},in_features={n_features},num_classes=2,"
+            f"epochs={epochs},batch_size={batch_size}"
+        )
+        timings = {
+            n: run_train(n, extra_vars=extra_vars, workdir=Path(tmpdir))
+            for n in map(int, num_processes.split(","))
+        }
+    baseline = next(iter(timings.values()))
+    for n, elapsed in timings.items():
+        click.echo(f"processes={n:<3} {elapsed:8.2f}s  speedup x{baseline / elapsed:.2f}")
+
+
+if __name__ == "__main__":
+    main()
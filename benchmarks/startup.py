@@ -0,0 +1,70 @@
+from pathlib import Path
+import statistics
+import subprocess
+import sys
+import time
+
+import click
+
+ROOT = Path(__file__).resolve().parent.parent
+HEAVY_MODULES = ("accelerate", "hydra", "ignite", "jinja2", "mlflow", "rich", "torch", "yaml")
+
+
+def measure(cmd: list[str], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=ROOT, check=True, capture_output=True)  # noqa: S603
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def loaded_heavy_modules(script: str) -> list[str]:
+    code = (
+        "import sys, runpy; sys.argv = [{0!r}, '--help']\n"
+        "try:\n"
+        "    runpy.run_path({0!r}, run_name='__main__')\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        "print(' '.join(sorted({{m.split('.')[0] for m in sys.modules}})))"
+    ).format(script)
+    result = subprocess.run(
+        [sys.executable, "-c", code],  # noqa: S603
+        cwd=ROOT,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    loaded = set(result.stdout.strip().splitlines()[-1].split())
+    return sorted(loaded.intersection(HEAVY_MODULES))
+
+
+@click.command(
+    help="Check that CLI entry points start within an import-time budget.",
+    context_settings={"help_option_names": ["-h", "--help"]},
+)
+@click.option("--repeat", type=click.INT, default=5, show_default=True)
+@click.option(
+    "--budget",
+    type=click.FLOAT,
+    default=1.0,
+    show_default=True,
+    help="Maximum median wall time in seconds for `--help`.",
+)
+def main(repeat: int = 5, budget: float = 1.0) -> None:
+    failed = False
+    for script in ("train.py", "infer.py", "autotune.py", "scripts/replay_metrics.py"):
+        elapsed = measure([sys.executable, script, "--help"], repeat=repeat)
+        heavy = loaded_heavy_modules(script)
+        ok = elapsed <= budget and len(heavy) == 0
+        failed |= not ok
+        click.echo(
+            f"{script:<26} {elapsed:.3f}s (budget {budget:.3f}s) "
+            f"heavy imports: {', '.join(heavy) or '-'} [{'ok' if ok else 'FAIL'}]"
+        )
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
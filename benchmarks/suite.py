@@ -0,0 +1,285 @@
+from typing import Any, Callable, Iterable
+from dataclasses import asdict, dataclass
+import json
+import os
+from pathlib import Path
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from accelerate import Accelerator
+import click
+import torch
+from torch.utils.data import DataLoader
+
+from benchmarks.data import ROOT, make_dataset
+from benchmarks.trainer import make_batches, steps_per_second
+from experiments.trainer import Trainer
+from movs_mlops_2023.datasets import dvc as dvc_datasets, jsonl
+from movs_mlops_2023.datasets.collator import Default
+from movs_mlops_2023.models import Classification
+
+
+@dataclass
+class Result:
+    value: float
+    unit: str
+    higher_is_better: bool = True
+
+
+def best_time(fn: Callable[[], Any], repeat: int) -> float:
+    # The fastest run is the least affected by noise from other processes.
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def count_rows(batches: Iterable[list[Any]]) -> int:
+    return sum(len(b) for b in batches)
+
+
+def read_samples(path: Path) -> list[dict[str, Any]]:
+    with path.open("r", encoding="utf-8") as file:
+        return [json.loads(line) for line in file]
+
+
+def make_dvc_repo(dir: Path, file: Path) -> Path:
+    """Track the file in a fresh DVC repo and push it to a local remote, leaving only the remote."""
+    repo, remote = dir / "dvc-repo", dir / "dvc-remote"
+    repo.mkdir(parents=True)
+    (repo / file.name).write_bytes(file.read_bytes())
+    for args in (
+        ["init", "--no-scm"],
+        ["remote", "add", "--default", "local", str(remote)],
+        ["add", file.name],
+        ["push"],
+    ):
+        cmd = [sys.executable, "-m", "dvc", *args, "--quiet"]
+        subprocess.run(cmd, cwd=repo, check=True, capture_output=True)  # noqa: S603
+    (repo / file.name).unlink()
+    shutil.rmtree(repo / ".dvc" / "cache")
+    return repo
+
+
+def bench_datasets(dir: Path, max_workers: int, batch_size: int, repeat: int) -> dict[str, Result]:
+    path = dir / "train.jsonl"
+    samples = read_samples(path)
+    rows = len(samples)
+
+    def iterate(dataset: Any, num_workers: int = 0) -> None:
+        # `list` as collate_fn measures reading and parsing only.
+        loader = DataLoader(
+            dataset, batch_size=batch_size, collate_fn=list, num_workers=num_workers
+        )
+        assert count_rows(loader) == rows  # noqa: S101
+
+    results = {
+        "jsonl.InMemory": Result(
+            rows / best_time(lambda: iterate(jsonl.InMemory(path)), repeat), "rows/s"
+        )
+    }
+    for num_workers in range(max_workers + 1):
+        elapsed = best_time(lambda n=num_workers: iterate(jsonl.Iter(path), n), repeat)
+        results[f"jsonl.Iter(num_workers={num_workers})"] = Result(rows / elapsed, "rows/s")
+    repo = make_dvc_repo(dir, path)
+    dataset = dvc_datasets.Iter(path.name, repo=str(repo), remote="local")
+    results["dvc.Iter(local remote)"] = Result(
+        rows / best_time(lambda: iterate(dataset), repeat), "rows/s"
+    )
+    collator = Default()
+    batches = [samples[i : i + batch_size] for i in range(0, rows, batch_size)]
+    elapsed = best_time(lambda: [collator(b) for b in batches], repeat)
+    results["collator.Default"] = Result(rows / elapsed, "rows/s")
+    return results
+
+
+def bench_trainer(n_batches: int, batch_size: int, in_features: int, repeat: int) -> Result:
+    accelerator = Accelerator(cpu=True)
+    batches = make_batches(n_batches, batch_size, in_features, num_classes=2, seed=13)
+    values = []
+    for _ in range(repeat):
+        torch.manual_seed(13)
+        model = Classification(in_features, num_classes=2)
+        optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
+        trainer = Trainer(model, optimizer=optimizer, accelerator=accelerator)
+        values.append(steps_per_second(trainer, batches, epochs=1, accelerator=accelerator))
+    return Result(max(values), "steps/s")
+
+
+def run_script(cmd: list[str]) -> tuple[float, int]:
+    """Run a script and return its wall time in seconds and peak RSS in MiB."""
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        cmd, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL  # noqa: S603
+    )
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+    # ru_maxrss is in KiB on Linux.
+    return elapsed, usage.ru_maxrss // 1024
+
+
+def bench_scripts(
+    dir: Path, in_features: int, batch_size: int, epochs: int, repeat: int
+) -> dict[str, Result]:
+    extra_vars = (
+        f"datasets={dir.relative_to(ROOT)},in_features={in_features},num_classes=2,"
+        f"batch_size={batch_size}"
+    )
+
+    def train(n_epochs: int) -> float:
+        cmd = [
+            sys.executable,
+            "train.py",
+            "--no-mlflow",
+            "--force",
+            f"--dir={dir / 'model'}",
+            f"--cache-dir={dir / 'cache'}",
+            f"--extra-vars={extra_vars},epochs={n_epochs}",
+        ]
+        shutil.rmtree(dir / "model", ignore_errors=True)
+        return run_script(cmd)[0]
+
+    # Startup, data hashing and saving are excluded by the difference of two runs.
+    epoch_time = (
+        min(train(1 + epochs) for _ in range(repeat)) - min(train(1) for _ in range(repeat))
+    ) / epochs
+    rows = len(read_samples(dir / "eval-no-target.jsonl"))
+    cmd = [
+        sys.executable,
+        "infer.py",
+        f"--model-path={dir / 'model' / 'best_iteration' / 'model.safetensors'}",
+        f"--out={dir / 'infer-results.csv'}",
+        f"--extra-vars={extra_vars}",
+    ]
+    timings, rss = zip(*(run_script(cmd) for _ in range(repeat)), strict=True)
+    elapsed, peak_rss = min(timings), max(rss)
+    return {
+        "train.py epoch": Result(epoch_time, "s", higher_is_better=False),
+        "infer.py": Result(rows / elapsed, "rows/s"),
+        "infer.py peak RSS": Result(peak_rss, "MiB", higher_is_better=False),
+    }
+
+
+def compare(
+    results: dict[str, Result], baseline: dict[str, Any], threshold: float
+) -> dict[str, float]:
+    """Return relative changes of results that are worse than baseline by more than threshold."""
+    regressions = {}
+    for name, result in results.items():
+        if name not in baseline or baseline[name]["value"] == 0:
+            continue
+        change = result.value / baseline[name]["value"] - 1
+        if (change if result.higher_is_better else -change) < -threshold:
+            regressions[name] = change
+    return regressions
+
+
+def write_report(path: Path, report: dict[str, Any]) -> None:
+    # The baseline is committed, so it ends with a newline like the other files.
+    with path.open("w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+        file.write("\n")
+
+
+@click.command(
+    help=(
+        "Measure throughput of data, training and inference paths "
+        "and compare it against a committed baseline."
+    ),
+    context_settings={"help_option_names": ["-h", "--help"]},
+)
+@click.option(
+    "--out",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=ROOT / "bench-results.json",
+    show_default=True,
+    help="Where to save results.",
+)
+@click.option(
+    "--baseline",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=ROOT / "benchmarks" / "baseline.json",
+    show_default=True,
+)
+@click.option(
+    "--threshold",
+    type=click.FloatRange(min=0),
+    default=0.25,
+    show_default=True,
+    help="Maximum allowed relative regression against baseline.",
+)
+@click.option("--update-baseline", is_flag=True, help="Overwrite baseline with results.")
+@click.option("--n-samples", type=click.INT, default=20_000, show_default=True)
+@click.option("--n-features", type=click.INT, default=30, show_default=True)
+@click.option("--batch-size", type=click.INT, default=64, show_default=True)
+@click.option("--max-workers", type=click.INT, default=2, show_default=True)
+@click.option("--epochs", type=click.INT, default=4, show_default=True)
+@click.option("--repeat", type=click.INT, default=5, show_default=True)
+def main(
+    out: Path,
+    baseline: Path,
+    threshold: float = 0.25,
+    update_baseline: bool = False,
+    n_samples: int = 20_000,
+    n_features: int = 30,
+    batch_size: int = 64,
+    max_workers: int = 2,
+    epochs: int = 4,
+    repeat: int = 5,
+) -> None:
+    # dvc.Iter in train.py and infer.py reads files from the repository workspace only.
+    (ROOT / "data").mkdir(exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=ROOT / "data") as tmpdir:
+        dir = make_dataset(Path(tmpdir), n_samples=n_samples, n_features=n_features)
+        results = bench_datasets(dir, max_workers=max_workers, batch_size=batch_size, repeat=repeat)
+        results["Trainer"] = bench_trainer(
+            n_batches=n_samples // batch_size,
+            batch_size=batch_size,
+            in_features=n_features,
+            repeat=repeat,
+        )
+        results |= bench_scripts(
+            dir, in_features=n_features, batch_size=batch_size, epochs=epochs, repeat=repeat
+        )
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "n_samples": n_samples,
+            "n_features": n_features,
+            "batch_size": batch_size,
+        },
+        "results": {name: asdict(r) for name, r in results.items()},
+    }
+    write_report(out, report)
+    if update_baseline:
+        write_report(baseline, report)
+        click.echo(f"Saved baseline in {baseline}")
+        return
+    expected = {}
+    if baseline.exists():
+        with baseline.open("r", encoding="utf-8") as file:
+            expected = json.load(file)["results"]
+    regressions = compare(results, expected, threshold=threshold)
+    click.echo(f"{'name':<30} {'value':>12} {'baseline':>12} unit")
+    for name, r in results.items():
+        base = f"{expected[name]['value']:12.1f}" if name in expected else f"{'-':>12}"
+        status = f"FAIL {regressions[name]:+.1%}" if name in regressions else "ok"
+        click.echo(f"{name:<30} {r.value:12.1f} {base} {r.unit:<8} [{status}]")
+    if len(regressions) > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
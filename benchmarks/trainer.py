@@ -0,0 +1,79 @@
+import time
+
+from accelerate import Accelerator
+import click
+from ignite.metrics import Accuracy, Fbeta, Precision, Recall
+import torch
+
+from experiments.options import attach_metrics
+from experiments.trainer import FastTrainer, Trainer
+from movs_mlops_2023.models import Classification
+
+
+def make_batches(
+    n_batches: int, batch_size: int, in_features: int, num_classes: int, seed: int
+) -> list[dict[str, torch.Tensor]]:
+    generator = torch.Generator().manual_seed(seed)
+    return [
+        {
+            "features": torch.randn(batch_size, in_features, generator=generator),
+            "target": torch.randint(num_classes, (batch_size,), generator=generator),
+        }
+        for _ in range(n_batches)
+    ]
+
+
+def steps_per_second(
+    trainer: Trainer, batches: list[dict[str, torch.Tensor]], epochs: int, accelerator: Accelerator
+) -> float:
+    metrics = {
+        "accuracy": Accuracy(),
+        "precision": Precision(),
+        "recall": Recall(),
+        "f1": Fbeta(beta=1.0),
+    }
+    attach_metrics(trainer, accelerator, metrics)
+    start = time.perf_counter()
+    trainer.run({"train": batches}, max_iters={}, epochs=epochs)
+    return len(batches) * epochs / (time.perf_counter() - start)
+
+
+@click.command(
+    help="Compare training throughput of Trainer and FastTrainer.",
+    context_settings={"help_option_names": ["-h", "--help"]},
+)
+@click.option("--n-batches", type=click.INT, default=2000, show_default=True)
+@click.option("--batch-size", type=click.INT, default=8, show_default=True)
+@click.option("--in-features", type=click.INT, default=30, show_default=True)
+@click.option("--num-classes", type=click.INT, default=2, show_default=True)
+@click.option("--epochs", type=click.INT, default=3, show_default=True)
+@click.option("--every", type=click.INT, default=50, show_default=True)
+@click.option("--seed", type=click.INT, default=13, show_default=True)
+def main(
+    n_batches: int = 2000,
+    batch_size: int = 8,
+    in_features: int = 30,
+    num_classes: int = 2,
+    epochs: int = 3,
+    every: int = 50,
+    seed: int = 13,
+) -> None:
+    accelerator = Accelerator(cpu=True)
+    batches = make_batches(n_batches, batch_size, in_features, num_classes, seed=seed)
+    results = {}
+    for name, trainer_cls, kwargs in (
+        ("ignite", Trainer, {}),
+        (f"fast(every={every})", FastTrainer, {"every": every}),
+    ):
+        torch.manual_seed(seed)
+        model = Classification(in_features, num_classes=num_classes)
+        optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
+        trainer = trainer_cls(model, optimizer=optimizer, accelerator=accelerator, **kwargs)
+        results[name] = steps_per_second(trainer, batches, epochs=epochs, accelerator=accelerator)
+    baseline = results["ignite"]
+    for name, value in results.items():
+        click.echo(f"{name:<20} {value:10.1f} steps/s  x{value / baseline:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+from typing import Iterable
+from concurrent.futures import ThreadPoolExecutor
+import errno
+import gzip
+import hashlib
+import os
+from pathlib import Path
+import shutil
+import stat
+import tarfile
+import threading
+
+from loguru import logger
+
+CHUNK_SIZE = 1 << 20
+_READ_ONLY = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+
+class ArtifactStore:
+    """
+    Local content-addressed store of run artifacts.
+
+    Every file is stored once under `objects` by sha256 of its content and made read-only,
+    so checkpoints, `best_iteration`, run cache entries and runs of a sweep share it by
+    hardlinks. A snapshot of a directory is a manifest of relative paths to hashes.
+    Gzip members of objects are compressed in parallel, cached next to them
+    and concatenated into archives, so unchanged files are never compressed twice.
+    """
+
+    def __init__(self, root: Path, workers: int | None = None, compresslevel: int = 6) -> None:
+        self._root = Path(root)
+        self._objects = self._root / "objects"
+        self._workers = workers or os.cpu_count() or 1
+        self._compresslevel = compresslevel
+
+    def add(self, dir: Path, names: Iterable[str] | None = None) -> dict[str, str]:
+        """
+        Store files of a directory and replace them with hardlinks to the stored objects.
+
+        Parameters
+        ----------
+        dir: Path
+            Directory with files.
+        names: Iterable[str] | None (default = None)
+            Files or subdirectories of `dir` to store. Everything in it by default.
+
+        Returns
+        -------
+        dict[str, str]
+            Manifest of paths relative to `dir` and hashes of their content.
+        """
+        paths = [dir / n for n in names] if names is not None else [dir]
+        files = sorted(
+            f
+            for p in paths
+            for f in (p.rglob("*") if p.is_dir() else [p] if p.is_file() else [])
+            if f.is_file()
+        )
+        with ThreadPoolExecutor(self._workers) as pool:
+            hashes = list(pool.map(self._add_file, files))
+        return {f.relative_to(dir).as_posix(): h for f, h in zip(files, hashes, strict=True)}
+
+    def put_bytes(self, data: bytes) -> str:
+        """Store bytes and return their hash."""
+        digest = hashlib.sha256(data).hexdigest()
+        if not (path := self.object_path(digest)).is_file():
+            with _Staging(path) as tmp:
+                tmp.write_bytes(data)
+        return digest
+
+    def materialize(self, manifest: dict[str, str], dir: Path) -> None:
+        """Hardlink objects of a manifest into a directory, copying them across file systems."""
+        for name, digest in manifest.items():
+            path = dir / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.unlink(missing_ok=True)
+            _link_or_copy(self.object_path(digest), path)
+
+    def archive(self, manifest: dict[str, str], path: Path) -> None:
+        """
+        Write objects of a manifest into a tar.gz archive under their paths.
+
+        The archive is a concatenation of gzip members, which tar and gzip read as one stream.
+        """
+        digests = sorted(set(manifest.values()))
+        with ThreadPoolExecutor(self._workers) as pool:
+            compressed = dict(zip(digests, pool.map(self._compressed, digests), strict=True))
+        tmp = path.with_name(f".{path.name}.tmp")
+        with tmp.open("wb") as file:
+            for name in sorted(manifest):
+                digest = manifest[name]
+                obj_stat = self.object_path(digest).stat()
+                info = tarfile.TarInfo(name)
+                info.size, info.mtime, info.mode = obj_stat.st_size, int(obj_stat.st_mtime), 0o644
+                file.write(gzip.compress(info.tobuf(format=tarfile.PAX_FORMAT), mtime=0))
+                with compressed[digest].open("rb") as member:
+                    shutil.copyfileobj(member, file, CHUNK_SIZE)
+            file.write(gzip.compress(b"\0" * 2 * tarfile.BLOCKSIZE, mtime=0))
+        tmp.replace(path)
+
+    def object_path(self, digest: str) -> Path:
+        return self._objects / digest[:2] / digest
+
+    def _add_file(self, path: Path) -> str:
+        digest = _file_hash(path)
+        obj = self.object_path(digest)
+        if not obj.is_file():
+            with _Staging(obj) as tmp:
+                _link_or_copy(path, tmp)
+        if path.stat().st_ino == obj.stat().st_ino:
+            return digest
+        # Replace the file with a link to the object atomically, so readers never miss it.
+        tmp = path.with_name(f".{path.name}.{_unique()}.link")
+        try:
+            os.link(obj, tmp)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            return digest
+        tmp.replace(path)
+        return digest
+
+    def _compressed(self, digest: str) -> Path:
+        path = self.object_path(digest).with_suffix(".gz")
+        if path.is_file():
+            return path
+        obj = self.object_path(digest)
+        size = obj.stat().st_size
+        with (
+            _Staging(path) as tmp,
+            obj.open("rb") as src,
+            tmp.open("wb") as raw,
+            # Empty name keeps temporary names out of gzip headers.
+            gzip.GzipFile("", "wb", self._compresslevel, fileobj=raw, mtime=0) as dst,
+        ):
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+            # Tar pads file data up to a whole block.
+            dst.write(b"\0" * (-size % tarfile.BLOCKSIZE))
+        logger.debug(f"artifacts: compressed {digest}")
+        return path
+
+
+class _Staging:
+    """Write a new object aside and move it in place, so concurrent runs see whole objects."""
+
+    def __init__(self, path: Path) -> None:
+        self._path = path
+        self._tmp = path.with_name(f".{path.name}.{_unique()}.tmp")
+
+    def __enter__(self) -> Path:
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._tmp.unlink(missing_ok=True)
+        return self._tmp
+
+    def __exit__(self, exc_type: type | None, *_) -> None:
+        if exc_type is not None:
+            self._tmp.unlink(missing_ok=True)
+            return
+        self._tmp.chmod(_READ_ONLY)
+        self._tmp.replace(self._path)
+
+
+def _file_hash(path: Path) -> str:
+    sha256 = hashlib.sha256()
+    with path.open("rb") as file:
+        while chunk := file.read(CHUNK_SIZE):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _unique() -> str:
+    return f"{os.getpid()}.{threading.get_ident()}"
+
+
+def _link_or_copy(src: Path, dst: Path) -> None:
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.copy2(src, dst)
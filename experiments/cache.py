@@ -0,0 +1,218 @@
+from typing import Any, Iterator
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+import subprocess
+import tempfile
+
+from loguru import logger
+
+from experiments.artifacts import ArtifactStore
+from experiments.utils import flatten_config
+
+METRICS_FILE = "metrics.json"
+MANIFEST_FILE = "artifacts.json"
+ARTIFACTS = ("best_iteration", "experiment.tar.gz")
+# Keys that do not change the outcome of a run.
+IGNORED_KEYS = ("mlflow_uri",)
+
+
+class RunCache:
+    """
+    Cache of completed runs keyed by a fingerprint of everything that affects the result.
+
+    Fingerprint consists of the flattened config, seed, debug mode, number of processes,
+    code version and content hashes of every dataset file referenced in the config.
+    Files that are not pulled from DVC are hashed by the md5 of their DVC output.
+    With an artifact store, entries keep a manifest of artifacts instead of their copies.
+    """
+
+    def __init__(self, dir: Path, store: ArtifactStore | None = None) -> None:
+        self._dir = dir
+        self._store = store
+
+    def fingerprint(self, config: dict[str, Any], seed: int, debug: bool = False) -> str | None:
+        """
+        Get a fingerprint of a run.
+
+        Parameters
+        ----------
+        config: dict[str, Any]
+            Run config.
+        seed: int
+            Random seed.
+        debug: bool (default = False)
+            Whether the run is in debug mode.
+
+        Returns
+        -------
+        str | None
+            Fingerprint or None if some dataset can not be hashed,
+            in which case the run should not be cached.
+        """
+        flat_config = {k: v for k, v in flatten_config(config).items() if k not in IGNORED_KEYS}
+        datasets = {}
+        for key, value in sorted(flat_config.items()):
+            if not key.endswith("path") or not isinstance(value, str):
+                continue
+            path = Path(value)
+            if (digest := file_hash(path) if path.is_file() else dvc_hash(path)) is None:
+                logger.warning(f"run cache: can not hash {value} from {key}, caching is off")
+                return None
+            datasets[value] = digest
+        data = {
+            "config": flat_config,
+            "seed": seed,
+            "debug": debug,
+            "world_size": int(os.getenv("WORLD_SIZE", "1")),
+            "code": code_version(),
+            "datasets": datasets,
+        }
+        return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+    def restore(self, fingerprint: str, dir: Path | None = None) -> dict[str, Any] | None:
+        """
+        Restore metrics and artifacts of a completed run.
+
+        Parameters
+        ----------
+        fingerprint: str
+            Run fingerprint.
+        dir: Path | None (default = None)
+            Experiment directory to restore artifacts into.
+
+        Returns
+        -------
+        dict[str, Any] | None
+            Metrics of a completed run or None if there is no such run.
+        """
+        run_dir = self._dir / fingerprint
+        if not (run_dir / METRICS_FILE).is_file():
+            return None
+        if dir is not None:
+            dir.mkdir(parents=True, exist_ok=True)
+            self._restore_artifacts(run_dir, dir)
+        with (run_dir / METRICS_FILE).open("r", encoding="utf-8") as file:
+            metrics = json.load(file)
+        logger.info(f"run cache: reused run {fingerprint} from {run_dir}")
+        return metrics
+
+    def _restore_artifacts(self, run_dir: Path, dir: Path) -> None:
+        if self._store is not None and (run_dir / MANIFEST_FILE).is_file():
+            with (run_dir / MANIFEST_FILE).open("r", encoding="utf-8") as file:
+                self._store.materialize(json.load(file), dir)
+            return
+        for name in ARTIFACTS:
+            if (path := run_dir / name).is_dir():
+                shutil.copytree(path, dir / name, dirs_exist_ok=True)
+            elif path.is_file():
+                shutil.copy2(path, dir / name)
+
+    def save(self, fingerprint: str, metrics: dict[str, Any], dir: Path | None = None) -> None:
+        """
+        Store metrics and artifacts of a completed run.
+
+        Parameters
+        ----------
+        fingerprint: str
+            Run fingerprint.
+        metrics: dict[str, Any]
+            Final metrics of the run.
+        dir: Path | None (default = None)
+            Experiment directory with artifacts.
+        """
+        self._dir.mkdir(parents=True, exist_ok=True)
+        run_dir = self._dir / fingerprint
+        # Build the entry aside and rename it so that only completed runs are ever visible.
+        with tempfile.TemporaryDirectory(dir=self._dir) as tmpdir:
+            tmp_run_dir = Path(tmpdir) / fingerprint
+            tmp_run_dir.mkdir()
+            if dir is not None:
+                self._save_artifacts(dir, tmp_run_dir)
+            with (tmp_run_dir / METRICS_FILE).open("w", encoding="utf-8") as file:
+                json.dump(metrics, file, indent=2)
+            shutil.rmtree(run_dir, ignore_errors=True)
+            tmp_run_dir.rename(run_dir)
+        logger.info(f"run cache: saved run {fingerprint} in {run_dir}")
+
+    def _save_artifacts(self, dir: Path, run_dir: Path) -> None:
+        if self._store is not None:
+            manifest = self._store.add(dir, names=ARTIFACTS)
+            with (run_dir / MANIFEST_FILE).open("w", encoding="utf-8") as file:
+                json.dump(manifest, file, indent=2)
+            return
+        for name in ARTIFACTS:
+            if (path := dir / name).is_dir():
+                shutil.copytree(path, run_dir / name)
+            elif path.is_file():
+                shutil.copy2(path, run_dir / name)
+
+
+def code_version() -> str:
+    try:
+        commit = _git("rev-parse", "HEAD")
+        diff = _git("diff", "HEAD", "--", "*.py", "*.j2")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}-{hashlib.md5(diff.encode()).hexdigest()}"  # noqa: S324
+
+
+def file_hash(path: Path) -> str:
+    """Get md5 of a file reusing the hashes DVC has already computed whenever possible."""
+    try:
+        from dvc.repo import Repo
+        from dvc_data.hashfile.hash import hash_file
+
+        with Repo(str(path.parent), uninitialized=False) as repo:
+            _, hash_info = hash_file(str(path.resolve()), repo.fs, "md5", repo.state)
+            return hash_info.value
+    except Exception as e:  # noqa: BLE001
+        logger.debug(f"run cache: no DVC hash for {path} ({e}), hashing file contents")
+    md5 = hashlib.md5()  # noqa: S324
+    with path.open("rb") as file:
+        while chunk := file.read(1 << 20):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def dvc_hash(path: Path) -> str | None:
+    """
+    Get md5 of a path from the .dvc file or dvc.lock of the DVC output holding it.
+
+    It does not need the data to be pulled. For paths inside a directory output
+    the md5 covers the whole directory, so the hash is conservative.
+    """
+    path = path.absolute()
+    for dir in path.parents:
+        for out, md5 in _dvc_outs(dir):
+            if out == path or out in path.parents:
+                return f"{md5}/{path.relative_to(out)}"
+        if (dir / ".dvc").is_dir():
+            break
+    return None
+
+
+def _dvc_outs(dir: Path) -> Iterator[tuple[Path, str]]:
+    import yaml
+
+    for dvc_file in sorted(p for p in dir.glob("*.dvc") if p.is_file()):
+        with dvc_file.open("r", encoding="utf-8") as file:
+            outs = (yaml.safe_load(file) or {}).get("outs", [])
+        yield from ((dir / out["path"], out["md5"]) for out in outs if "md5" in out)
+    if (lock_file := dir / "dvc.lock").is_file():
+        with lock_file.open("r", encoding="utf-8") as file:
+            stages = (yaml.safe_load(file) or {}).get("stages", {})
+        for stage in stages.values():
+            outs = stage.get("outs", [])
+            yield from ((dir / out["path"], out["md5"]) for out in outs if "md5" in out)
+
+
+def _git(*args: str) -> str:
+    return subprocess.run(
+        ["git", *args],  # noqa: S603, S607
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
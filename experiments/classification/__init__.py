@@ -1 +1,10 @@
-from experiments.classification.exp import ClassificationExperiment as Experiment
+from typing import Any
+
+
+def __getattr__(name: str) -> Any:
+    # Experiment pulls in accelerate, hydra and ignite, so it is only imported on first access.
+    if name == "Experiment":
+        from experiments.classification.exp import ClassificationExperiment
+
+        return ClassificationExperiment
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,28 +1,54 @@
 # pyright: reportOptionalMemberAccess=false
 
 from typing import Any, Callable
+import json
 from pathlib import Path
 
 from accelerate import Accelerator
-from accelerate.utils import ProjectConfiguration, set_seed
+from accelerate.utils import (
+    GradientAccumulationPlugin,
+    ProjectConfiguration,
+    broadcast_object_list,
+    set_seed,
+)
 from hydra.utils import instantiate
 from ignite.engine import EventEnum
 from ignite.metrics import Metric
+from loguru import logger
 from rich import print_json
+from safetensors.torch import load_model
 import torch
+from torch.utils.data import DataLoader, IterableDataset
 
 from experiments import settings
+from experiments.artifacts import ArtifactStore
 from experiments.base import Experiment
 from experiments.options import (
+    BEST_ITERATION_PATH,
+    TRAIN_OFFSETS_FILE,
     attach_best_exp_saver,
     attach_checkpointer,
     attach_debug_handler,
     attach_log_epoch_metrics,
+    attach_log_iteration_metrics,
+    attach_memory_monitor,
     attach_metrics,
+    attach_prefetch_metrics,
+    attach_profiler,
     attach_progress_bar,
+    attach_stream_positions,
+    attach_train_offsets_saver,
 )
-from experiments.trainer import Trainer
+from experiments.trackers import make_trackers
+from experiments.trainer import FastTrainer, Trainer
 from experiments.utils import flatten_config
+from movs_mlops_2023.datasets.cache import Cached
+from movs_mlops_2023.datasets.prefetch import Prefetcher
+from movs_mlops_2023.datasets.preload import Preloaded
+from movs_mlops_2023.datasets.sharding import EvenShards, ShardedLines
+
+# Runs are on CPU, where accelerate silently turns fp16 off instead of failing.
+MIXED_PRECISIONS = ("no", "bf16")
 
 
 class ClassificationExperiment(Experiment):
@@ -35,11 +61,45 @@ class ClassificationExperiment(Experiment):
         events: dict[str, list[tuple[EventEnum, Callable]]] = None,
         seed: int = 13,
         debug: bool = False,
+        fast_every: int = 0,
+        profile: bool = False,
+        log_every: int = 0,
+        log_queue_size: int = 1024,
+        log_policy: str = "block",
+        memory: dict[str, Any] | None = None,
+        mixed_precision: str = "no",
+        gradient_accumulation_steps: int = 1,
+        num_threads: int = 0,
+        checkpoint_every: int = 0,
+        resume: bool = False,
+        warm_start: Path | None = None,
+        replay: int = 0,
+        artifact_store: ArtifactStore | None = None,
     ) -> None:
+        if mixed_precision not in MIXED_PRECISIONS:
+            raise ValueError(
+                f"mixed_precision={mixed_precision} is not supported on CPU. "
+                f"Choose one of {', '.join(MIXED_PRECISIONS)}."
+            )
         self._config = exp_config if isinstance(exp_config, dict) else exp_config()
         self._dir = dir
         self._seed = seed
         self._debug = debug
+        self._fast_every = fast_every
+        self._profile = profile
+        self._log_every = log_every
+        self._log_queue_size = log_queue_size
+        self._log_policy = log_policy
+        self._memory = memory or {}
+        self._mixed_precision = mixed_precision
+        self._gradient_accumulation_steps = gradient_accumulation_steps
+        self._num_threads = num_threads
+        self._checkpoint_every = checkpoint_every
+        self._resume = resume
+        self._warm_start = warm_start
+        self._replay = replay
+        self._train_offsets: dict[str, int] = {}
+        self._store = artifact_store
         self._metrics = metrics or {}
         self._trackers_params = trackers_params or {}
         self._events = events or {}
@@ -49,6 +109,8 @@ class ClassificationExperiment(Experiment):
         return self._state.metrics
 
     def run(self) -> Any:
+        if self._num_threads > 0:
+            torch.set_num_threads(self._num_threads)
         self._accelerator = self._get_accelerator()
         print_json(data=self._config)
         self._model = self._accelerator.prepare(instantiate(self._config["model"]))
@@ -56,8 +118,11 @@ class ClassificationExperiment(Experiment):
             instantiate(self._config["optimizer"])(self._model.parameters())
         )
         max_iters = {k: d.pop("max_iters", None) for k, d in self._config["datasets"].items()}
+        prefetch = {k: d.pop("prefetch", 0) for k, d in self._config["datasets"].items()}
+        preload = {k: d.pop("preload", False) for k, d in self._config["datasets"].items()}
+        cache = {k: d.pop("cache", None) or {} for k, d in self._config["datasets"].items()}
         self._datasets = {
-            key: self._accelerator.prepare_data_loader(
+            key: self._prepare_loader(
                 instantiate(
                     loader,
                     generator=torch.Generator().manual_seed(self._seed),
@@ -66,7 +131,20 @@ class ClassificationExperiment(Experiment):
             )
             for key, loader in self._config["datasets"].items()
         }
+        self._select_train_rows()
+        self._datasets = {
+            key: self._wrap_loader(
+                loader, prefetch=prefetch[key], preload=preload[key], cache=cache[key]
+            )
+            for key, loader in self._datasets.items()
+        }
+        if "train" in self._datasets and self._accelerator.num_processes > 1:
+            self._datasets["train"] = EvenShards(self._datasets["train"])
+        if self._warm_start is not None:
+            self._load_warm_start()
         self.trainer = self._get_trainer(self._model, self._optimizer)
+        if self._resume:
+            self._load_checkpoint()
         self._state = self.trainer.run(
             self._datasets, max_iters=max_iters, epochs=self._config["epochs"]
         )
@@ -83,9 +161,21 @@ class ClassificationExperiment(Experiment):
         del self._accelerator, self.trainer
 
     def _get_accelerator(self) -> Accelerator:
+        trackers = make_trackers(
+            settings.MLFLOW_PROJECT,
+            self._trackers_params,
+            queue_size=self._log_queue_size,
+            policy=self._log_policy,
+        )
         accelerator = Accelerator(
-            log_with=list(self._trackers_params) if len(self._trackers_params) > 0 else None,
+            log_with=trackers or None,
             cpu=True,
+            mixed_precision=self._mixed_precision,
+            # Loaders are wrapped by prefetching, preloading and sharding, so accelerate
+            # can not see their end and accumulation windows continue across epochs.
+            gradient_accumulation_plugin=GradientAccumulationPlugin(
+                num_steps=self._gradient_accumulation_steps, sync_with_dataloader=False
+            ),
         )
         if self._dir is not None:
             accelerator.project_configuration = ProjectConfiguration(
@@ -95,34 +185,172 @@ class ClassificationExperiment(Experiment):
         accelerator.init_trackers(
             project_name=settings.MLFLOW_PROJECT,
             config=flatten_config(self._config),
-            init_kwargs=self._trackers_params,
         )
         self._seed_everything()
         return accelerator
 
     def _get_trainer(self, model: torch.nn.Module, optimizer: torch.optim.Optimizer) -> Trainer:
-        trainer = Trainer(model, optimizer=optimizer, accelerator=self._accelerator)
+        trainer = (
+            FastTrainer(
+                model, optimizer=optimizer, accelerator=self._accelerator, every=self._fast_every
+            )
+            if self._fast_every > 0
+            else Trainer(model, optimizer=optimizer, accelerator=self._accelerator)
+        )
         if self._debug:
             attach_debug_handler(trainer, num_iters=2000)
         attach_metrics(trainer, self._accelerator, self._metrics)
-        attach_progress_bar(
-            trainer,
-            metric_names={
-                "eval": ["loss"] + list(self._metrics),
-                "train": ["loss"] + list(self._metrics),
-            },
-        )
-        attach_log_epoch_metrics(trainer, self._accelerator)
-        if self._dir is not None:
-            attach_checkpointer(
-                trainer, self._accelerator, checkpoint_objects=self._metrics.values()
+        if self._accelerator.is_main_process:
+            attach_progress_bar(
+                trainer,
+                metric_names={
+                    "eval": ["loss"] + list(self._metrics),
+                    "train": ["loss"] + list(self._metrics),
+                },
             )
-            attach_best_exp_saver(trainer, self._dir, config=self._config)
+            attach_log_epoch_metrics(trainer, self._accelerator)
+            if self._log_every > 0:
+                attach_log_iteration_metrics(trainer, self._accelerator, every=self._log_every)
+            attach_prefetch_metrics(trainer, self._accelerator, self._datasets)
+        if self._profile and self._accelerator.is_main_process:
+            attach_profiler(
+                trainer,
+                self._accelerator,
+                loaders=self._datasets,
+                trace_path=(self._dir or Path.cwd()) / "profile-trace.json"
+                if self._debug
+                else None,
+            )
+        if self._memory.pop("enabled", False):
+            attach_memory_monitor(
+                trainer, self._accelerator, loaders=self._datasets, **self._memory
+            )
+        self._attach_checkpointing(trainer)
         for key, e in self._events.items():
             for event, handler in e:
                 trainer.add_event(key, event, handler, accelerator=self._accelerator)
         return trainer
 
+    def _attach_checkpointing(self, trainer: Trainer) -> None:
+        if (stream := self._train_stream()) is not None:
+            attach_stream_positions(trainer, self._accelerator, stream)
+        if self._dir is None:
+            return
+        attach_checkpointer(
+            trainer,
+            self._accelerator,
+            checkpoint_objects=self._metrics.values(),
+            every=self._checkpoint_every,
+            store=self._store,
+        )
+        if self._accelerator.is_main_process:
+            if len(self._train_offsets) > 0:
+                attach_train_offsets_saver(trainer, self._dir, self._train_offsets)
+            attach_best_exp_saver(trainer, self._dir, config=self._config, store=self._store)
+
+    def _train_stream(self) -> ShardedLines | None:
+        dataset = self._train_lines()
+        return dataset if dataset is not None and dataset.track_position else None
+
+    def _train_lines(self) -> ShardedLines | None:
+        loader = self._datasets.get("train")
+        # Prefetcher and EvenShards keep the wrapped loader, Preloaded reads it all upfront.
+        while not isinstance(loader, DataLoader) and hasattr(loader, "loader"):
+            loader = loader.loader
+        dataset = getattr(loader, "dataset", None)
+        return dataset if isinstance(dataset, ShardedLines) else None
+
+    def _select_train_rows(self) -> None:
+        if (dataset := self._train_lines()) is None:
+            if self._warm_start is not None:
+                raise ValueError("Warm start needs train data of JSON lines read by ShardedLines")
+            return
+        if self._warm_start is None:
+            # Full runs read the file as is, so the next warm start gets an offset
+            # only if it is known without an extra pass over the file.
+            if (size := self._from_main_process(dataset.known_size)) is not None:
+                self._train_offsets = {dataset.source: size}
+            return
+        # Rows appended during the run are left for the next one, all processes read the same.
+        start = self._warm_start_offsets().get(dataset.source, 0)
+        stop = self._from_main_process(dataset.size)
+        if start > stop:
+            raise ValueError(
+                f"{dataset.source} is shorter than when {self._warm_start} was trained, "
+                "warm start works with files that are only appended to"
+            )
+        if start == stop and self._replay == 0:
+            raise ValueError(f"No rows were appended to {dataset.source} since {self._warm_start}")
+        logger.info(f"warm start: training on {stop - start} new bytes of {dataset.source}")
+        dataset.select(start=start, stop=stop, replay=self._replay, seed=self._seed)
+        self._train_offsets = {dataset.source: stop}
+
+    def _from_main_process(self, fn: Callable[[], Any]) -> Any:
+        value = fn() if self._accelerator.is_main_process else None
+        return broadcast_object_list([value])[0]
+
+    def _warm_start_offsets(self) -> dict[str, int]:
+        path = self._warm_start / BEST_ITERATION_PATH / TRAIN_OFFSETS_FILE
+        if not path.is_file():
+            logger.warning(f"warm start: {self._warm_start} has no train offsets, reading all rows")
+            return {}
+        with path.open("r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def _load_warm_start(self) -> None:
+        source = self._warm_start / BEST_ITERATION_PATH
+        load_model(self._accelerator.unwrap_model(self._model), source / "model.safetensors")
+        self._optimizer.load_state_dict(
+            torch.load(source / "optimizer.bin", map_location="cpu", weights_only=True)
+        )
+        logger.info(f"warm start: loaded model and optimizer from {source}")
+
+    def _load_checkpoint(self) -> None:
+        if self._dir is None:
+            raise ValueError("Resuming needs an experiment directory with checkpoints")
+        checkpoints = sorted(
+            (self._dir / "checkpoints").glob("checkpoint_*"),
+            key=lambda p: int(p.name.rpartition("_")[-1]),
+        )
+        if len(checkpoints) == 0:
+            logger.warning(f"resume: no checkpoints in {self._dir}, starting from scratch")
+            return
+        self._accelerator.load_state(str(checkpoints[-1]))
+        # Automatic naming counts from zero and would clash with the existing checkpoints.
+        self._accelerator.project_configuration.iteration = (
+            int(checkpoints[-1].name.rpartition("_")[-1]) + 1
+        )
+        state = self.trainer.engines["train"].state
+        logger.info(f"resume: loaded {checkpoints[-1].name} at iteration {state.iteration}")
+        if state.resumed and self._train_stream() is None:
+            logger.warning(
+                "resume: train data does not track positions, "
+                "the interrupted epoch continues with new batches from its beginning"
+            )
+
+    def _prepare_loader(self, loader: DataLoader) -> DataLoader:
+        # Iterable datasets shard by rank themselves, accelerate would read all of it on every rank.
+        if self._accelerator.num_processes > 1 and isinstance(loader.dataset, IterableDataset):
+            return loader
+        return self._accelerator.prepare_data_loader(loader)
+
+    def _wrap_loader(
+        self,
+        loader: DataLoader,
+        prefetch: int = 0,
+        preload: bool = False,
+        cache: dict[str, Any] | None = None,
+    ) -> Any:
+        if preload:
+            return Preloaded(loader, generator=torch.Generator().manual_seed(self._seed))
+        if prefetch > 0:
+            loader = Prefetcher(loader, size=prefetch)
+        # Later passes are served from the cache and skip prefetching too.
+        cache = dict(cache or {})
+        if cache.pop("enabled", False):
+            return Cached(loader, **cache)
+        return loader
+
     def _seed_everything(self) -> None:
         import os
         import random
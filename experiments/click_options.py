@@ -76,6 +76,12 @@ class State:
     debug: bool = False
     use_mlflow: bool = False
     extra_vars: dict[str, Any] | None = None
+    cache_dir: Path | None = None
+    force: bool = False
+    metrics_file: Path | None = None
+    resume: bool = False
+    artifact_store: Path | None = None
+    warm_start: Path | None = None
 
 
 pass_state = click.make_pass_decorator(State, ensure=True)
@@ -153,6 +159,169 @@ def dir_option(default: str | None = None) -> Callable:
     return wrapper
 
 
+def cache_dir_option(default: str | None = None) -> Callable:
+    """
+    Add cache-dir option to CLI command.
+
+    Parameters
+    ----------
+    default: str | None (default = None)
+        Directory with cached runs.
+
+    Returns
+    -------
+    Callable
+        Click command/group with new option.
+    """
+
+    def wrapper(f: Callable) -> Callable:
+        def callback(ctx: click.Context, _: click.core.Parameter, value: Path | None) -> Any:
+            state: State = ctx.ensure_object(State)
+            state.cache_dir = value
+            return value
+
+        return click.option(
+            "--cache-dir",
+            type=click.Path(file_okay=False, path_type=Path),
+            help="Directory with completed runs to reuse.",
+            callback=callback,
+            expose_value=False,
+            required=False,
+            default=default,
+            show_default=True,
+        )(f)
+
+    return wrapper
+
+
+def artifact_store_option(default: str | None = None) -> Callable:
+    """
+    Add artifact-store option to CLI command.
+
+    Parameters
+    ----------
+    default: str | None (default = None)
+        Directory of the content-addressed artifact store.
+
+    Returns
+    -------
+    Callable
+        Click command/group with new option.
+    """
+
+    def wrapper(f: Callable) -> Callable:
+        def callback(ctx: click.Context, _: click.core.Parameter, value: Path | None) -> Any:
+            state: State = ctx.ensure_object(State)
+            state.artifact_store = value
+            return value
+
+        return click.option(
+            "--artifact-store",
+            type=click.Path(file_okay=False, path_type=Path),
+            help="Directory where checkpoints and archives of all runs share deduplicated files.",
+            callback=callback,
+            expose_value=False,
+            required=False,
+            default=default,
+            show_default=True,
+        )(f)
+
+    return wrapper
+
+
+def force_option(f: Callable) -> Callable:
+    """
+    Add force option to CLI command.
+
+    Parameters
+    ----------
+    f: Callable
+        Click command/group.
+
+    Returns
+    -------
+    Callable
+        Click command/group with new option.
+    """
+
+    def callback(ctx: click.Context, _: click.core.Parameter, value: bool) -> Any:
+        state: State = ctx.ensure_object(State)
+        state.force = value
+        return value
+
+    return click.option(
+        "--force",
+        is_flag=True,
+        help="Run experiment even if a completed run with the same fingerprint exists.",
+        callback=callback,
+        expose_value=False,
+        required=False,
+    )(f)
+
+
+def resume_option(f: Callable) -> Callable:
+    """
+    Add resume option to CLI command.
+
+    Parameters
+    ----------
+    f: Callable
+        Click command/group.
+
+    Returns
+    -------
+    Callable
+        Click command/group with new option.
+    """
+
+    def callback(ctx: click.Context, _: click.core.Parameter, value: bool) -> Any:
+        state: State = ctx.ensure_object(State)
+        state.resume = value
+        return value
+
+    return click.option(
+        "--resume",
+        is_flag=True,
+        help="Continue the run from the latest checkpoint in the experiment directory.",
+        callback=callback,
+        expose_value=False,
+        required=False,
+    )(f)
+
+
+def warm_start_option(f: Callable) -> Callable:
+    """
+    Add warm-start option to CLI command.
+
+    Parameters
+    ----------
+    f: Callable
+        Click command/group.
+
+    Returns
+    -------
+    Callable
+        Click command/group with new option.
+    """
+
+    def callback(ctx: click.Context, _: click.core.Parameter, value: Path | None) -> Any:
+        state: State = ctx.ensure_object(State)
+        state.warm_start = value
+        return value
+
+    return click.option(
+        "--warm-start",
+        type=click.Path(exists=True, file_okay=False, path_type=Path),
+        help=(
+            "Directory of a previous run to continue from its best iteration "
+            "on train rows appended since then."
+        ),
+        callback=callback,
+        expose_value=False,
+        required=False,
+    )(f)
+
+
 def debug_option(f: Callable) -> Callable:
     """
     Add debug option to CLI command.
@@ -245,6 +414,37 @@ def no_mlflow_option(f: Callable) -> Callable:
     )(f)
 
 
+def metrics_file_option(f: Callable) -> Callable:
+    """
+    Add metrics-file option to CLI command.
+
+    Parameters
+    ----------
+    f: Callable
+        Click command/group.
+
+    Returns
+    -------
+    Callable
+        Click command/group with new option.
+    """
+
+    def callback(ctx: click.Context, _: click.core.Parameter, value: Path | None) -> Any:
+        state: State = ctx.ensure_object(State)
+        state.metrics_file = value
+        return value
+
+    return click.option(
+        "--metrics-file",
+        type=click.Path(dir_okay=False, path_type=Path),
+        help="Append params and metrics to a local file that can be replayed into MLflow.",
+        callback=callback,
+        expose_value=False,
+        required=False,
+        default=None,
+    )(f)
+
+
 def extra_vars_option(f: Callable) -> Callable:
     """
     Add extra-vars option to CLI command.
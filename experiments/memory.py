@@ -0,0 +1,140 @@
+from typing import Any, Iterable
+from dataclasses import dataclass
+import os
+from pathlib import Path
+import resource
+import sys
+import tracemalloc
+
+import torch
+
+MB = 1024 * 1024
+
+
+@dataclass
+class ProcessMemory:
+    """Memory of a process in MB. PSS splits pages shared with forked workers between them."""
+
+    pid: int
+    rss: float
+    peak_rss: float
+    pss: float
+
+
+def process_memory(pid: int | None = None) -> ProcessMemory | None:
+    """
+    Read memory of a process from procfs.
+
+    Parameters
+    ----------
+    pid: int | None (default = None)
+        Process id. The current process by default.
+
+    Returns
+    -------
+    ProcessMemory | None
+        Memory of the process or None if it has exited.
+        Only peak RSS of the current process is known without procfs.
+    """
+    pid = pid or os.getpid()
+    status = _read_kb(Path(f"/proc/{pid}/status"), keys=("VmRSS", "VmHWM"))
+    if status is None:
+        if pid != os.getpid():
+            return None
+        # ru_maxrss is in KiB on Linux.
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return ProcessMemory(pid, rss=peak_rss, peak_rss=peak_rss, pss=peak_rss)
+    rollup = _read_kb(Path(f"/proc/{pid}/smaps_rollup"), keys=("Pss",)) or {}
+    return ProcessMemory(
+        pid,
+        rss=status["VmRSS"] / 1024,
+        peak_rss=status["VmHWM"] / 1024,
+        pss=rollup.get("Pss", status["VmRSS"]) / 1024,
+    )
+
+
+def children_memory() -> list[ProcessMemory]:
+    """Memory of child processes of the current one (DataLoader workers) ordered by pid."""
+    pids = set()
+    for path in Path(f"/proc/{os.getpid()}/task").glob("*/children"):
+        try:
+            pids.update(int(pid) for pid in path.read_text().split())
+        except OSError:
+            continue
+    return [m for m in map(process_memory, sorted(pids)) if m is not None]
+
+
+def tensors_size(tensors: Iterable[Any]) -> float:
+    """Size in MB of unique storages of tensors."""
+    storages = {}
+    for t in tensors:
+        if isinstance(t, torch.Tensor):
+            storage = t.untyped_storage()
+            storages[storage.data_ptr()] = storage.nbytes()
+    return sum(storages.values()) / MB
+
+
+def optimizer_tensors(optimizer: torch.optim.Optimizer | None) -> Iterable[Any]:
+    if optimizer is None:
+        return []
+    return (t for state in optimizer.state.values() for t in state.values())
+
+
+def object_size(obj: Any, sample: int = 1000) -> float:
+    """
+    Approximate size in MB of nested dicts, lists and tuples of tensors and Python objects.
+
+    Storages of tensors are counted once. Sequences longer than `sample` are measured
+    by `sample` evenly spaced items and extrapolated, so that large ones are sized quickly.
+    """
+    return _deep_size(obj, storages=set(), sample=sample) / MB
+
+
+def samples_size(dataset: Any, sample: int = 1000) -> float:
+    """Approximate size in MB of samples of a map-style dataset measured like `object_size`."""
+    if (size := len(dataset)) == 0:
+        return 0.0
+    indices = range(0, size, max(size // sample, 1))
+    return object_size([dataset[i] for i in indices], sample=sample) * size / len(indices)
+
+
+def python_stats() -> dict[str, float]:
+    """Allocation stats of the Python interpreter. Traced sizes are known only under tracemalloc."""
+    stats = {"python_blocks": float(sys.getallocatedblocks())}
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        stats |= {"python_traced_mb": current / MB, "python_traced_peak_mb": peak / MB}
+    return stats
+
+
+def _deep_size(obj: Any, storages: set[int], sample: int) -> float:
+    if isinstance(obj, torch.Tensor):
+        storage = obj.untyped_storage()
+        if storage.data_ptr() in storages:
+            return 0
+        storages.add(storage.data_ptr())
+        return storage.nbytes()
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        return size + sum(
+            _deep_size(k, storages, sample) + _deep_size(v, storages, sample)
+            for k, v in obj.items()
+        )
+    if isinstance(obj, (list, tuple)) and len(obj) > 0:
+        items = obj[:: max(len(obj) // sample, 1)]
+        items_size = sum(_deep_size(item, storages, sample) for item in items)
+        return size + items_size * len(obj) / len(items)
+    return size
+
+
+def _read_kb(path: Path, keys: tuple[str, ...]) -> dict[str, float] | None:
+    try:
+        lines = path.read_text().splitlines()
+    except OSError:
+        return None
+    values = {}
+    for line in lines:
+        key, _, value = line.partition(":")
+        if key in keys:
+            values[key] = float(value.split()[0])
+    return values if len(values) == len(keys) else None
@@ -1,26 +1,44 @@
 # pyright: reportOptionalSubscript=false, reportOptionalMemberAccess=false
 
-from typing import Any, Iterable, cast
+from typing import TYPE_CHECKING, Any, Callable, Iterable, cast
+from collections import defaultdict
+from functools import partial
+import json
 from pathlib import Path
 import shutil
 import tarfile
 import tempfile
+import time
 
-from accelerate import Accelerator
-from ignite.contrib.handlers.tqdm_logger import ProgressBar
 from ignite.engine import Engine, Events
 from ignite.metrics import Metric, MetricUsage
 from loguru import logger
+import numpy as np
 import torch
-import yaml
+from torch.utils.data import DataLoader
 
-from experiments.trainer import ModelEvents, Trainer
+from experiments.artifacts import ArtifactStore
+from experiments.trainer import (
+    CheckpointEvents,
+    ModelEvents,
+    ResumableState,
+    Trainer,
+    every_iterations,
+)
+from movs_mlops_2023.datasets.jsonl import InMemory
+from movs_mlops_2023.datasets.prefetch import Prefetcher
+from movs_mlops_2023.datasets.sharding import POSITION_KEY, ShardedLines
+
+if TYPE_CHECKING:
+    from accelerate import Accelerator
+    from ignite.handlers import EpochOutputStore
 
 BEST_ITERATION_PATH = "best_iteration"
+TRAIN_OFFSETS_FILE = "train-offsets.json"
 
 
 def attach_metrics(
-    trainer: Trainer, accelerator: Accelerator, metrics: dict[str, Metric] | None = None
+    trainer: Trainer, accelerator: "Accelerator", metrics: dict[str, Metric] | None = None
 ) -> None:
     def prepare_handler(engine: Engine) -> None:
         batch = cast(dict[str, torch.Tensor], engine.state.batch)
@@ -29,9 +47,17 @@ def attach_metrics(
 
     if metrics is None:
         return
+    # Metrics are synced across processes on compute, so with several of them
+    # it happens once per epoch to keep collectives in step.
     metric_usage = MetricUsage(
-        started=Events.EPOCH_STARTED,
-        completed=Events.ITERATION_COMPLETED,
+        # Engines reset epoch_iteration on EPOCH_STARTED unless the epoch is resumed
+        # from a checkpoint, then metrics keep their restored state.
+        started=Events.EPOCH_STARTED(
+            event_filter=lambda engine, _: engine.state.epoch_iteration == 0
+        ),
+        completed=(
+            Events.ITERATION_COMPLETED if accelerator.num_processes == 1 else Events.EPOCH_COMPLETED
+        ),
         iteration_completed=Events.ITERATION_COMPLETED,
     )
     for m in metrics.values():
@@ -45,28 +71,155 @@ def attach_metrics(
 
 def attach_checkpointer(
     trainer: Trainer,
-    accelerator: Accelerator,
+    accelerator: "Accelerator",
     checkpoint_objects: Iterable[object] | None = None,
+    every: int = 0,
+    store: ArtifactStore | None = None,
 ) -> None:
-    def save_handler(engine: Engine) -> None:
+    """
+    Save state of the run with `accelerator.save_state` after every evaluation.
+
+    Engines are registered through ResumableState, so a run can continue from a checkpoint
+    in the middle of an epoch. If `every` is positive, the train state is also saved every
+    `every` iterations, and the latest evaluated checkpoint is still the best one.
+    A checkpoint within an epoch is removed once a newer one is saved, so they do not pile up.
+    With a store, files of checkpoints are replaced with links to deduplicated objects
+    and `best_iteration` links to them instead of being a copy.
+    """
+
+    within_epoch: list[str] = []
+
+    def save_handler(engine: Engine, mid_epoch: bool = False) -> None:
+        engine.fire_event(CheckpointEvents.SAVE_STARTED)
+        # All processes take part in save_state, the main one writes model and optimizer.
         engine.state.save_location = accelerator.save_state()
-        logger.info(f"checkpointer: saved checkpoint in {engine.state.save_location}")
+        if store is not None:
+            engine.state.save_manifest = _store_checkpoint(
+                accelerator, store, engine.state.save_location
+            )
+        if accelerator.is_main_process:
+            logger.info(f"checkpointer: saved checkpoint in {engine.state.save_location}")
+        # The previous checkpoint within an epoch is kept until the new one is complete.
+        _remove_checkpoints(accelerator, within_epoch)
+        within_epoch[:] = [engine.state.save_location] if mid_epoch else []
 
     def save_best_handler(engine: Engine) -> None:
-        save_dir = Path(accelerator.project_dir) / BEST_ITERATION_PATH
-        shutil.copytree(engine.state.save_location, save_dir, dirs_exist_ok=True)
+        if accelerator.is_main_process:
+            save_dir = Path(accelerator.project_dir) / BEST_ITERATION_PATH
+            if store is not None:
+                store.materialize(engine.state.save_manifest, save_dir)
+            else:
+                shutil.copytree(engine.state.save_location, save_dir, dirs_exist_ok=True)
+        engine.fire_event(CheckpointEvents.SAVE_COMPLETED)
 
     for e in trainer.engines.values():
-        accelerator.register_for_checkpointing(e)
+        accelerator.register_for_checkpointing(ResumableState(e))
     for m in checkpoint_objects or []:
         accelerator.register_for_checkpointing(m)
     trainer.add_event("eval", Events.COMPLETED, save_handler)
     trainer.add_event("eval", Events.COMPLETED, save_best_handler)
+    if every > 0:
+        trainer.add_event(
+            "train",
+            Events.ITERATION_COMPLETED(event_filter=every_iterations(every)),
+            save_handler,
+            mid_epoch=True,
+        )
+
+
+def _remove_checkpoints(accelerator: "Accelerator", locations: list[str]) -> None:
+    # Other processes may still be writing their RNG states into the new checkpoint.
+    accelerator.wait_for_everyone()
+    if accelerator.is_main_process:
+        for location in locations:
+            shutil.rmtree(location, ignore_errors=True)
+
+
+def _store_checkpoint(
+    accelerator: "Accelerator", store: ArtifactStore, location: str
+) -> dict[str, str] | None:
+    # Other processes write their RNG states into the same checkpoint.
+    accelerator.wait_for_everyone()
+    return store.add(Path(location)) if accelerator.is_main_process else None
+
+
+class _StreamPositions:
+    def __init__(self, dataset: ShardedLines) -> None:
+        self.dataset = dataset
+        self.offsets: dict[int, int] = {}
+        self.num_shards: int | None = None
+
+    def update(self, positions: torch.Tensor) -> None:
+        for shard, num_shards, offset in positions.tolist():
+            self.offsets[shard] = max(self.offsets.get(shard, 0), offset)
+            self.num_shards = num_shards
+
+    def reset(self) -> None:
+        self.offsets, self.num_shards = {}, None
+        self.dataset.resume({})
+
+    def state_dict(self) -> dict[str, Any]:
+        from accelerate.utils import gather_object
+
+        # Shard indices are global, and every process reads its own shards.
+        offsets = {}
+        for process_offsets in gather_object([self.offsets]):
+            offsets |= process_offsets
+        return {"offsets": offsets, "num_shards": self.num_shards}
+
+    def load_state_dict(self, state_dict: dict[str, Any]) -> None:
+        self.offsets, self.num_shards = dict(state_dict["offsets"]), state_dict["num_shards"]
+        self.dataset.resume(self.offsets, num_shards=self.num_shards)
+
+
+def attach_stream_positions(
+    trainer: Trainer, accelerator: "Accelerator", dataset: ShardedLines
+) -> None:
+    """
+    Checkpoint byte offsets of the train stream consumed by training steps.
+
+    Offsets come from positions of samples in batches that reached ITERATION_COMPLETED,
+    so batches prefetched by workers or Prefetcher are read again after resuming.
+    The dataset should track positions, they are reset at the end of every epoch.
+    """
+
+    def update_handler(engine: Engine) -> None:
+        batch = cast(dict[str, torch.Tensor], engine.state.batch)
+        positions.update(batch[POSITION_KEY])
+
+    def reset_handler() -> None:
+        positions.reset()
+
+    if not dataset.track_position:
+        raise ValueError("attach_stream_positions needs a dataset with track_position=True")
+    positions = _StreamPositions(dataset)
+    accelerator.register_for_checkpointing(positions)
+    trainer.add_event("train", Events.ITERATION_COMPLETED, update_handler)
+    trainer.add_event("train", Events.EPOCH_COMPLETED, reset_handler)
+
+
+def attach_train_offsets_saver(trainer: Trainer, dir: Path, offsets: dict[str, int]) -> None:
+    """
+    Write byte offsets up to which train files were read into the best iteration directory.
+
+    A warm start from the run reads them to train only on rows appended later.
+    It should be attached before `attach_best_exp_saver` to get into the archive.
+    """
+
+    def handler() -> None:
+        path = dir / BEST_ITERATION_PATH / TRAIN_OFFSETS_FILE
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("w", encoding="utf-8") as file:
+            json.dump(offsets, file, indent=2)
+
+    trainer.add_event("train", Events.COMPLETED, handler)
 
 
 def attach_progress_bar(
     trainer: Trainer, metric_names: dict[str, str | list[str]] | None = None
 ) -> None:
+    from ignite.contrib.handlers.tqdm_logger import ProgressBar
+
     metric_names = metric_names or {}
     for key, e in trainer.engines.items():
         pbar = ProgressBar(
@@ -81,6 +234,155 @@ def attach_progress_bar(
         pbar.attach(e, metric_names=metric_names.get(key))
 
 
+class _PhaseTimings:
+    def __init__(self, trace: bool = False) -> None:
+        self.trace: list[dict[str, Any]] | None = [] if trace else None
+        self._timings: dict[str, dict[str, list[float]]] = defaultdict(lambda: defaultdict(list))
+        self._marks: dict[str, tuple[float, str | None]] = {}
+
+    def mark(self, key: str, opens: str | None, closes: str | None = None) -> None:
+        now = time.perf_counter()
+        if (last := self._marks.get(key)) is not None and (phase := closes or last[1]) is not None:
+            self.record(key, phase, last[0], now)
+        self._marks[key] = (now, opens)
+
+    def reset(self, key: str) -> None:
+        self._marks.pop(key, None)
+
+    def record(self, key: str, phase: str, start: float, end: float) -> None:
+        self._timings[key][phase].append(end - start)
+        if self.trace is None:
+            return
+        self.trace.append(
+            {
+                "name": phase,
+                "ph": "X",
+                "pid": 0,
+                "tid": key,
+                "ts": start * 1e6,
+                "dur": (end - start) * 1e6,
+            }
+        )
+
+    def pop_percentiles(self, key: str, q: tuple[int, ...]) -> dict[str, np.ndarray]:
+        timings = self._timings.pop(key, {})
+        return {phase: np.percentile(v, q) * 1e3 for phase, v in timings.items() if len(v) > 0}
+
+
+def attach_profiler(
+    trainer: Trainer,
+    accelerator: "Accelerator",
+    loaders: dict[str, Any] | None = None,
+    trace_path: Path | None = None,
+) -> None:
+    """
+    Measure wall time of step phases and log their percentiles per epoch.
+
+    Phases are data (waiting for a batch), collate, forward, backward, optimizer,
+    metrics (ITERATION_COMPLETED handlers), eval (whole eval pass) and checkpoint.
+    Collation is timed only when it runs in the main process and may overlap with
+    other phases under prefetching. FastTrainer does not fire step events,
+    so only eval and checkpoint phases are measured with it.
+    If trace_path is set, a Chrome trace of all phases is written there on completion.
+    """
+    timings = _PhaseTimings(trace=trace_path is not None)
+    spans: dict[str, float] = {}
+    quantiles = (50, 90, 99)
+
+    def phase_handler(engine: Engine, opens: str | None, closes: str | None = None) -> None:
+        timings.mark(engine.state.name, opens, closes)
+
+    def reset_handler(engine: Engine) -> None:
+        timings.reset(engine.state.name)
+
+    def span_started(_: Engine, phase: str) -> None:
+        spans[phase] = time.perf_counter()
+
+    def span_completed(_: Engine, phase: str) -> None:
+        timings.record("train", phase, spans.pop(phase), time.perf_counter())
+
+    def log_handler(engine: Engine) -> None:
+        key = engine.state.name
+        phase_handler(engine, opens=None)
+        reset_handler(engine)
+        _log_percentiles(accelerator, key, timings.pop_percentiles(key, quantiles), quantiles)
+
+    def trace_handler() -> None:
+        trace_path.parent.mkdir(parents=True, exist_ok=True)
+        with trace_path.open("w", encoding="utf-8") as file:
+            json.dump({"traceEvents": timings.trace}, file)
+        logger.info(f"profiler: saved trace in {trace_path}")
+
+    _time_collate(loaders, timings)
+    events = (
+        (Events.GET_BATCH_STARTED, {"opens": "data"}),
+        (Events.GET_BATCH_COMPLETED, {"opens": None}),
+        (ModelEvents.FORWARD_STARTED, {"opens": "forward"}),
+        (ModelEvents.FORWARD_COMPLETED, {"opens": "metrics"}),
+        (ModelEvents.BACKWARD_COMPLETED, {"opens": "optimizer", "closes": "backward"}),
+        (ModelEvents.OPTIMIZER_STEP_COMPLETED, {"opens": "metrics"}),
+    )
+    for key in trainer.engines:
+        trainer.add_event(key, Events.EPOCH_STARTED, reset_handler)
+        for event, kwargs in events:
+            trainer.add_event(key, event, phase_handler, **kwargs)
+        trainer.add_event(key, Events.EPOCH_COMPLETED, log_handler)
+    trainer.add_event("eval", Events.STARTED, span_started, "eval")
+    trainer.add_event("eval", Events.EPOCH_COMPLETED, span_completed, "eval")
+    trainer.add_event("eval", CheckpointEvents.SAVE_STARTED, span_started, "checkpoint")
+    trainer.add_event("eval", CheckpointEvents.SAVE_COMPLETED, span_completed, "checkpoint")
+    trainer.add_event("train", Events.COMPLETED, log_handler)
+    if trace_path is not None:
+        trainer.add_event("train", Events.COMPLETED, trace_handler)
+
+
+def _log_percentiles(
+    accelerator: "Accelerator", key: str, stats: dict[str, np.ndarray], quantiles: tuple[int, ...]
+) -> None:
+    if len(stats) == 0:
+        return
+    logger.info(f"Profile {key} (ms {' / '.join(f'p{q}' for q in quantiles)})")
+    max_length = max(len(x) for x in stats)
+    for phase, values in stats.items():
+        logger.info(f"{phase.ljust(max_length)} | {' / '.join(f'{v:.3f}' for v in values)}")
+    accelerator.log(
+        {
+            f"profile_{phase}_p{q}_epoch/{key}": value
+            for phase, values in stats.items()
+            for q, value in zip(quantiles, values, strict=True)
+        }
+    )
+
+
+def _time_collate(loaders: dict[str, Any] | None, timings: _PhaseTimings) -> None:
+    for key, loader in (loaders or {}).items():
+        _wrap_collate(loader, callback=partial(timings.record, key, "collate"))
+
+
+def _unwrap_loader(loader: Any) -> Any:
+    # Unwrap prefetching and accelerate loaders to reach the one that runs collate_fn.
+    while (
+        inner := getattr(loader, "base_dataloader", getattr(loader, "loader", None))
+    ) is not None:
+        loader = inner
+    return loader
+
+
+def _wrap_collate(loader: Any, callback: Callable[[float, float], None]) -> None:
+    loader = _unwrap_loader(loader)
+    if not isinstance(loader, DataLoader) or loader.num_workers > 0:
+        return
+    collate_fn = loader.collate_fn
+
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        start = time.perf_counter()
+        batch = collate_fn(*args, **kwargs)
+        callback(start, time.perf_counter())
+        return batch
+
+    loader.collate_fn = wrapper
+
+
 def attach_debug_handler(trainer: Trainer, num_iters: int = 100) -> None:
     def handler(engine: Engine) -> None:
         if engine.state.epoch_iteration < num_iters:
@@ -91,7 +393,7 @@ def attach_debug_handler(trainer: Trainer, num_iters: int = 100) -> None:
         trainer.add_event(e, Events.ITERATION_COMPLETED, handler)
 
 
-def attach_log_epoch_metrics(trainer: Trainer, accelerator: Accelerator) -> None:
+def attach_log_epoch_metrics(trainer: Trainer, accelerator: "Accelerator") -> None:
     def handler(engine: Engine) -> None:
         metrics = {
             k: v.item() if isinstance(v, torch.Tensor) else v
@@ -113,9 +415,169 @@ def attach_log_epoch_metrics(trainer: Trainer, accelerator: Accelerator) -> None
         trainer.add_event(e, Events.EPOCH_COMPLETED, handler)
 
 
-def attach_best_exp_saver(trainer: Trainer, dir: Path, config: dict[str, Any]) -> None:
+def attach_log_iteration_metrics(
+    trainer: Trainer, accelerator: "Accelerator", every: int = 100
+) -> None:
+    def handler(engine: Engine) -> None:
+        output = cast(dict[str, torch.Tensor], engine.state.output)
+        if "loss" not in output:
+            return
+        accelerator.log(
+            {f"loss_iter/{engine.state.name}": output["loss"].item()},
+            step=engine.state.iteration,
+        )
+
+    trainer.add_event(
+        "train", Events.ITERATION_COMPLETED(event_filter=every_iterations(every)), handler
+    )
+
+
+def attach_prefetch_metrics(
+    trainer: Trainer, accelerator: "Accelerator", loaders: dict[str, Any]
+) -> None:
+    def reset_handler(_: Engine, loader: Prefetcher) -> None:
+        loader.reset_stats()
+
+    def handler(engine: Engine, loader: Prefetcher) -> None:
+        run_type, stats = engine.state.name, loader.stats
+        logger.info(
+            f"prefetch: {run_type} waited {stats.wait_time:.4f}s for {stats.batches} batches "
+            f"with mean queue depth {stats.mean_depth:.2f}"
+        )
+        accelerator.log(
+            {
+                f"prefetch_wait_epoch/{run_type}": stats.wait_time,
+                f"prefetch_depth_epoch/{run_type}": stats.mean_depth,
+            }
+        )
+
+    for key, loader in loaders.items():
+        if not isinstance(loader, Prefetcher) or key not in trainer.engines:
+            continue
+        trainer.add_event(key, Events.EPOCH_STARTED, reset_handler, loader)
+        trainer.add_event(key, Events.EPOCH_COMPLETED, handler, loader)
+
+
+def attach_memory_monitor(
+    trainer: Trainer,
+    accelerator: "Accelerator",
+    every: int = 0,
+    budget_mb: float | None = None,
+    on_exceed: str = "warn",
+    loaders: dict[str, Any] | None = None,
+    outputs: Iterable["EpochOutputStore"] | None = None,
+) -> None:
+    """
+    Sample memory of the process and its DataLoader workers and log it through trackers.
+
+    Samples are taken at the end of every epoch and, if `every` is positive, every `every`
+    iterations. Workers that are not persistent exit at the end of an epoch,
+    so they are seen only by samples within it. The breakdown also has approximate sizes
+    of InMemory samples of `loaders`, outputs collected by `outputs` and state dicts
+    saved in checkpoints besides model and optimizer.
+    Total is the sum of PSS of all processes. When it is over `budget_mb`,
+    the breakdown is logged as a warning (on_exceed="warn") or the run is aborted with it
+    (on_exceed="abort").
+    """
+    if on_exceed not in ("warn", "abort"):
+        raise ValueError(f"on_exceed should be warn or abort (on_exceed={on_exceed})")
+    warned_epochs: set[tuple[str, int]] = set()
+
+    def handler(engine: Engine, suffix: str) -> None:
+        key = engine.state.name
+        stats = _memory_stats(trainer) | _objects_stats(
+            accelerator, loaders=loaders or {}, outputs=outputs or []
+        )
+        accelerator.log(
+            {f"memory_{k}_{suffix}/{key}": v for k, v in stats.items()},
+            step=engine.state.iteration if suffix == "iter" else None,
+        )
+        if suffix == "epoch":
+            logger.info(f"memory: {key} {_format_memory(stats)}")
+        if budget_mb is None or stats["total_mb"] <= budget_mb:
+            return
+        message = f"memory: {key} is over budget of {budget_mb:.1f}MB, {_format_memory(stats)}"
+        if on_exceed == "abort":
+            raise RuntimeError(message)
+        if (key, engine.state.epoch) not in warned_epochs:
+            warned_epochs.add((key, engine.state.epoch))
+            logger.warning(message)
+
+    for key in trainer.engines:
+        trainer.add_event(key, Events.EPOCH_COMPLETED, handler, "epoch")
+        if every > 0:
+            trainer.add_event(
+                key,
+                Events.ITERATION_COMPLETED(event_filter=every_iterations(every)),
+                handler,
+                "iter",
+            )
+
+
+def _memory_stats(trainer: Trainer) -> dict[str, float]:
+    from experiments.memory import (
+        children_memory,
+        optimizer_tensors,
+        process_memory,
+        python_stats,
+        tensors_size,
+    )
+
+    main, workers = process_memory(), children_memory()
+    stats = {
+        "total_mb": main.pss + sum(w.pss for w in workers),
+        "rss_mb": main.rss,
+        "peak_rss_mb": main.peak_rss,
+        "workers_mb": sum(w.pss for w in workers),
+        "workers_peak_rss_mb": max((w.peak_rss for w in workers), default=0.0),
+        "model_mb": tensors_size([*trainer.model.parameters(), *trainer.model.buffers()]),
+        "optimizer_mb": tensors_size(optimizer_tensors(trainer.optimizer)),
+    }
+    stats |= {f"worker{i}_mb": w.pss for i, w in enumerate(workers)}
+    if torch.cuda.is_available():
+        stats["torch_cuda_mb"] = torch.cuda.memory_allocated() / 2**20
+        stats["torch_cuda_peak_mb"] = torch.cuda.max_memory_allocated() / 2**20
+    return stats | python_stats()
+
+
+def _objects_stats(
+    accelerator: "Accelerator", loaders: dict[str, Any], outputs: Iterable["EpochOutputStore"]
+) -> dict[str, float]:
+    from experiments.memory import object_size, samples_size
+
+    stats = {
+        f"dataset_{key}_mb": samples_size(dataset)
+        for key, loader in loaders.items()
+        if isinstance(dataset := getattr(_unwrap_loader(loader), "dataset", None), InMemory)
+    }
+    if len(outputs := list(outputs)) > 0:
+        stats["outputs_mb"] = sum(object_size(o.data) for o in outputs)
+    stats["checkpoint_mb"] = object_size(
+        [o.state_dict() for o in accelerator._custom_objects]  # noqa: SLF001
+    )
+    return stats
+
+
+def _format_memory(stats: dict[str, float]) -> str:
+    return ", ".join(
+        f"{k.removesuffix('_mb')}={v:.2f}MB" if k.endswith("_mb") else f"{k}={v:.0f}"
+        for k, v in stats.items()
+    )
+
+
+def attach_best_exp_saver(
+    trainer: Trainer, dir: Path, config: dict[str, Any], store: ArtifactStore | None = None
+) -> None:
     def handler() -> None:
+        import yaml
+
         exp_archive = dir / "experiment.tar.gz"
+        if store is not None:
+            # Compressed files of the store are reused, only new ones are compressed.
+            manifest = store.add(dir, names=[BEST_ITERATION_PATH])
+            manifest["config.yaml"] = store.put_bytes(yaml.dump(config, indent=2).encode())
+            store.archive(manifest, exp_archive)
+            return
         with tempfile.TemporaryDirectory() as tmpdir, tarfile.open(exp_archive, "w:gz") as archive:
             config_path = Path(tmpdir) / "config.yaml"
             with config_path.open("w", encoding="utf-8") as file:
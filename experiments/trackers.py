@@ -0,0 +1,310 @@
+from typing import Any
+import json
+from pathlib import Path
+import queue
+import threading
+import time
+
+from accelerate.tracking import GeneralTracker, MLflowTracker as _MLflowTracker
+from loguru import logger
+
+POLICIES = ("block", "drop")
+_STOP = object()
+
+
+class MLflowTracker(_MLflowTracker):
+    """
+    MLflow tracker that writes with MlflowClient to the run started in `start`.
+
+    The fluent API keeps the active run per thread, so the accelerate tracker
+    would log into a new run when called from AsyncTracker.
+    """
+
+    def store_init_configuration(self, values: dict[str, Any]) -> None:
+        from mlflow.entities import Param
+        from mlflow.utils.validation import MAX_PARAM_VAL_LENGTH
+
+        self._log_batch(
+            params=[
+                Param(k, str(v)) for k, v in values.items() if len(str(v)) <= MAX_PARAM_VAL_LENGTH
+            ]
+        )
+
+    def log(self, values: dict[str, Any], step: int | None = None, **_) -> None:
+        from mlflow.entities import Metric
+
+        timestamp = int(time.time() * 1000)
+        self._log_batch(
+            metrics=[
+                Metric(k, v, timestamp, step or 0)
+                for k, v in values.items()
+                if isinstance(v, (int, float))
+            ]
+        )
+
+    def _log_batch(self, metrics: list[Any] | None = None, params: list[Any] | None = None) -> None:
+        _log_batch(self.active_run.info.run_id, metrics=metrics, params=params)
+
+
+class FileTracker(GeneralTracker):
+    """
+    Append params and metrics to a local JSON Lines file.
+
+    Every line is a record with kind (run, params or metrics), values, step and wall time,
+    so the file can be replayed into MLflow later with `replay_to_mlflow`.
+    The file is opened on the first write as accelerate<1.0 does not call `start`.
+    """
+
+    name = "file"
+    requires_logging_directory = False
+
+    def __init__(self, project_name: str, path: Path | str, run_name: str | None = None) -> None:
+        super().__init__()
+        self._project_name = project_name
+        self._path = Path(path)
+        self._run_name = run_name
+        self._file = None
+
+    @property
+    def tracker(self) -> Any:
+        return self._file
+
+    def start(self) -> None:
+        if self._file is not None:
+            return
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = self._path.open("a", encoding="utf-8")
+        self._write("run", {"project_name": self._project_name, "run_name": self._run_name})
+
+    def store_init_configuration(self, values: dict[str, Any]) -> None:
+        self._write("params", values)
+
+    def log(self, values: dict[str, Any], step: int | None = None, **_) -> None:
+        self._write("metrics", values, step=step)
+
+    def finish(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write(self, kind: str, values: dict[str, Any], step: int | None = None) -> None:
+        if self._file is None:
+            self.start()
+        record = {"kind": kind, "values": values, "step": step, "time": time.time()}
+        self._file.write(json.dumps(record, default=str) + "\n")
+        self._file.flush()
+
+
+class AsyncTracker(GeneralTracker):
+    """
+    Queue writes to a tracker and flush them in batches from a background thread.
+
+    Once the queue holds `queue_size` writes, the block policy makes the training loop wait
+    for the tracker and the drop policy discards new metrics (params are never dropped).
+    Metrics of consecutive `log` calls are merged into a single write when keys do not clash.
+    The thread is started on the first write as accelerate<1.0 does not call `start`.
+    """
+
+    def __init__(
+        self,
+        tracker: GeneralTracker,
+        queue_size: int = 1024,
+        policy: str = "block",
+        flush_interval: float = 1.0,
+    ) -> None:
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown policy {policy}. Choose one of {', '.join(POLICIES)}.")
+        super().__init__(_blank=True)
+        self.dropped = 0
+        self._tracker = tracker
+        self._policy = policy
+        self._flush_interval = flush_interval
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread: threading.Thread | None = None
+
+    @property
+    def name(self) -> str:
+        return self._tracker.name
+
+    @property
+    def requires_logging_directory(self) -> bool:
+        return self._tracker.requires_logging_directory
+
+    @property
+    def tracker(self) -> Any:
+        return self._tracker.tracker
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        # Trackers of accelerate<1.0 have no start and are started in __init__.
+        if (start := getattr(self._tracker, "start", None)) is not None:
+            start()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def store_init_configuration(self, values: dict[str, Any]) -> None:
+        self.start()
+        self._queue.put(("params", dict(values), None, {}))
+
+    def log(self, values: dict[str, Any], step: int | None = None, **kwargs) -> None:
+        self.start()
+        item = ("metrics", dict(values), step, kwargs)
+        if self._policy == "block":
+            self._queue.put(item)
+            return
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def finish(self) -> None:
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+        if self.dropped > 0:
+            logger.warning(f"trackers: dropped {self.dropped} writes to {self.name}")
+        self._tracker.finish()
+
+    def _run(self) -> None:
+        stopped = False
+        while not stopped:
+            items = [self._queue.get()]
+            deadline = time.monotonic() + self._flush_interval
+            # A batch is capped by the queue size to keep memory bounded.
+            while (
+                items[-1] is not _STOP
+                and len(items) < self._queue.maxsize
+                and (timeout := deadline - time.monotonic()) > 0
+            ):
+                try:
+                    items.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if stopped := items[-1] is _STOP:
+                items.pop()
+            self._flush(items)
+
+    def _flush(self, items: list[tuple[str, dict[str, Any], int | None, dict[str, Any]]]) -> None:
+        merged: list[tuple[str, dict[str, Any], int | None, dict[str, Any]]] = []
+        for kind, values, step, kwargs in items:
+            if (
+                len(merged) > 0
+                and kind == "metrics"
+                and merged[-1][0] == kind
+                and merged[-1][2:] == (step, kwargs)
+                and merged[-1][1].keys().isdisjoint(values)
+            ):
+                merged[-1][1].update(values)
+                continue
+            merged.append((kind, values, step, kwargs))
+        for kind, values, step, kwargs in merged:
+            try:
+                if kind == "params":
+                    self._tracker.store_init_configuration(values)
+                else:
+                    self._tracker.log(values, step=step, **kwargs)
+            except Exception:  # noqa: BLE001
+                logger.opt(exception=True).warning(f"trackers: failed to write to {self.name}")
+
+
+TRACKERS = {"mlflow": MLflowTracker, "file": FileTracker}
+
+
+def make_trackers(
+    project_name: str,
+    trackers_params: dict[str, dict[str, Any]],
+    queue_size: int = 0,
+    policy: str = "block",
+    flush_interval: float = 1.0,
+) -> list[GeneralTracker]:
+    """
+    Create trackers for Accelerator.
+
+    Parameters
+    ----------
+    project_name: str
+        Name of the project (experiment in MLflow).
+    trackers_params: dict[str, dict[str, Any]]
+        Keyword arguments of every tracker by its name (mlflow or file).
+    queue_size: int (default = 0)
+        Size of the queue for writes in the background. Trackers are synchronous if it is 0.
+    policy: str (default = "block")
+        What to do with new metrics when the queue is full: block or drop.
+    flush_interval: float (default = 1.0)
+        Maximum time in seconds to collect writes into a batch.
+
+    Returns
+    -------
+    list[GeneralTracker]
+        Trackers to pass to Accelerator as log_with.
+    """
+    trackers = []
+    for name, params in trackers_params.items():
+        if name not in TRACKERS:
+            raise ValueError(f"Unknown tracker {name}. Choose from {', '.join(TRACKERS)}.")
+        tracker = TRACKERS[name](project_name, **params)
+        if queue_size > 0:
+            tracker = AsyncTracker(
+                tracker, queue_size=queue_size, policy=policy, flush_interval=flush_interval
+            )
+        trackers.append(tracker)
+    return trackers
+
+
+def replay_to_mlflow(path: Path, run_name: str | None = None) -> str:
+    """
+    Log records of a FileTracker file into a new MLflow run keeping their steps and times.
+
+    Parameters
+    ----------
+    path: Path
+        File written by FileTracker.
+    run_name: str | None (default = None)
+        Name of the new run. The one stored in the file is used by default.
+
+    Returns
+    -------
+    str
+        Id of the created MLflow run.
+    """
+    import mlflow
+    from mlflow.entities import Metric, Param
+
+    with path.open("r", encoding="utf-8") as file:
+        records = [json.loads(line) for line in file]
+    if len(records) == 0 or records[0]["kind"] != "run":
+        raise ValueError(f"{path} is not a file tracker log")
+    run_info = records[0]["values"]
+    mlflow.set_experiment(run_info["project_name"])
+    with mlflow.start_run(run_name=run_name or run_info["run_name"]) as run:
+        params = [
+            Param(k, str(v))
+            for r in records
+            if r["kind"] == "params"
+            for k, v in r["values"].items()
+        ]
+        metrics = [
+            Metric(k, v, int(r["time"] * 1000), r["step"] or 0)
+            for r in records
+            if r["kind"] == "metrics"
+            for k, v in r["values"].items()
+            if isinstance(v, (int, float))
+        ]
+        _log_batch(run.info.run_id, metrics=metrics, params=params)
+    return run.info.run_id
+
+
+def _log_batch(
+    run_id: str, metrics: list[Any] | None = None, params: list[Any] | None = None
+) -> None:
+    import mlflow
+    from mlflow.utils.validation import MAX_METRICS_PER_BATCH, MAX_PARAMS_TAGS_PER_BATCH
+
+    client = mlflow.MlflowClient()
+    metrics, params = metrics or [], params or []
+    for i in range(0, len(params), MAX_PARAMS_TAGS_PER_BATCH):
+        client.log_batch(run_id, params=params[i : i + MAX_PARAMS_TAGS_PER_BATCH])
+    for i in range(0, len(metrics), MAX_METRICS_PER_BATCH):
+        client.log_batch(run_id, metrics=metrics[i : i + MAX_METRICS_PER_BATCH])
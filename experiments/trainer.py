@@ -1,14 +1,24 @@
-from typing import Any, Callable
+from typing import TYPE_CHECKING, Any, Callable
+from itertools import islice
 
-from accelerate import Accelerator
 from ignite.engine import Engine, EventEnum, Events, State
 import torch
 from torch.utils.data import DataLoader
 
+if TYPE_CHECKING:
+    from accelerate import Accelerator
+
 
 class ModelEvents(EventEnum):
     FORWARD_STARTED = "forward_started"
     FORWARD_COMPLETED = "forward_completed"
+    BACKWARD_COMPLETED = "backward_completed"
+    OPTIMIZER_STEP_COMPLETED = "optimizer_step_completed"
+
+
+class CheckpointEvents(EventEnum):
+    SAVE_STARTED = "save_started"
+    SAVE_COMPLETED = "save_completed"
 
 
 class Trainer:
@@ -16,7 +26,7 @@ class Trainer:
         self,
         model: torch.nn.Module,
         optimizer: torch.optim.Optimizer,
-        accelerator: Accelerator,
+        accelerator: "Accelerator",
     ) -> None:
         self.model = model
         self.optimizer = optimizer
@@ -26,6 +36,8 @@ class Trainer:
         for key, e in self.engines.items():
             e.state.name = key
             e.state.epoch_iteration = 0
+            e.state.resumed = False
+            e.state.iteration_steps = 1
             e.state_dict_user_keys.append("name")
             e.state_dict_user_keys.append("epoch_iteration")
 
@@ -39,50 +51,65 @@ class Trainer:
     ) -> State:
         self._loaders = loaders
         self._max_iters = max_iters
-        self.engines["train"].run(
-            self._loaders["train"],
-            epoch_length=self._max_iters.get("train"),
-            max_epochs=epochs,
-        )
+        if not self._finished(epochs or 1):
+            self.engines["train"].run(
+                self._loaders["train"],
+                epoch_length=self._max_iters.get("train"),
+                max_epochs=epochs,
+            )
         return self.engines["eval"].state if "eval" in loaders else self.engines["train"].state
 
+    def _finished(self, epochs: int) -> bool:
+        # Set only when the state is loaded from a checkpoint of a completed run.
+        state = self.engines["train"].state
+        return state.max_epochs is not None and state.epoch >= epochs and not state.resumed
+
     def _train_step(
         self, engine: Engine, batch: dict[str, torch.Tensor]
     ) -> dict[str, torch.Tensor]:
         self.model.train()
         with self._accelerator.accumulate(self.model):
-            state = engine.state
-            engine.fire_event(ModelEvents.FORWARD_STARTED)
-            output = state.output = self.model(batch)
-            engine.fire_event(ModelEvents.FORWARD_COMPLETED)
+            output = self._forward(engine, batch)
             if "loss" not in output:
                 return output
+            # Loss is scaled by the number of accumulation steps inside backward only,
+            # so `_loss` stays a sum of per-batch losses.
             self._accelerator.backward(output["loss"])
-            self.optimizer.step()
-            self.optimizer.zero_grad()
-            state.metrics["_loss"] += output["loss"].detach()
+            self._fire_step_event(engine, ModelEvents.BACKWARD_COMPLETED)
+            if self._accelerator.sync_gradients:
+                self.optimizer.step()
+                self.optimizer.zero_grad()
+                self._fire_step_event(engine, ModelEvents.OPTIMIZER_STEP_COMPLETED)
+            engine.state.metrics["_loss"] += output["loss"].detach()
             return output
 
     def _eval_step(self, engine: Engine, batch: dict[str, torch.Tensor]) -> dict[str, torch.Tensor]:
         self.model.eval()
         with torch.no_grad():
-            state = engine.state
-            engine.fire_event(ModelEvents.FORWARD_STARTED)
-            output = state.output = self.model(batch)
-            engine.fire_event(ModelEvents.FORWARD_COMPLETED)
+            output = self._forward(engine, batch)
             if "loss" in output:
-                state.metrics["_loss"] += output["loss"].detach()
+                engine.state.metrics["_loss"] += output["loss"].detach()
             return output
 
+    def _forward(self, engine: Engine, batch: dict[str, torch.Tensor]) -> dict[str, torch.Tensor]:
+        self._fire_step_event(engine, ModelEvents.FORWARD_STARTED)
+        output = engine.state.output = self.model(batch)
+        self._fire_step_event(engine, ModelEvents.FORWARD_COMPLETED)
+        return output
+
+    def _fire_step_event(self, engine: Engine, event: ModelEvents) -> None:
+        engine.fire_event(event)
+
     def _add_events(self) -> None:
         for e in self.engines.values():
-            for events in (ModelEvents,):
+            for events in (ModelEvents, CheckpointEvents):
                 e.register_events(*events)
         self.add_event("train", Events.EPOCH_STARTED | Events.COMPLETED, self._run_eval)
         events = (
             (Events.EPOCH_STARTED, self._reset_epoch),
             (Events.ITERATION_COMPLETED, self._update_iteration),
             (Events.ITERATION_COMPLETED, self._update_loss),
+            (Events.EPOCH_COMPLETED, self._reduce_loss),
         )
         for e in self.engines:
             for args in events:
@@ -90,12 +117,16 @@ class Trainer:
 
     def _run_eval(self) -> None:
         eval_loader = self._loaders.get("eval")
-        if eval_loader is None:
+        # An epoch continued from a checkpoint has been evaluated before it started.
+        if eval_loader is None or self.engines["train"].state.resumed:
             return
         self.engines["eval"].run(eval_loader, epoch_length=self._max_iters.get("eval"))
 
     def _reset_epoch(self, engine: Engine) -> None:
         state = engine.state
+        if state.resumed:
+            state.resumed = False
+            return
         state.metrics["_loss"] = torch.tensor(0.0, device=self._accelerator.device)
         state.epoch_iteration = 0
 
@@ -103,5 +134,183 @@ class Trainer:
         engine.state.epoch_iteration += 1
 
     def _update_loss(self, engine: Engine) -> None:
+        # Average over batches rather than optimizer steps, which does not depend
+        # on gradient accumulation and matches how metrics count samples.
         state = engine.state
         state.metrics["loss"] = state.metrics["_loss"] / state.epoch_iteration
+
+    def _reduce_loss(self, engine: Engine) -> None:
+        # Average loss over steps of every process, it has to run on all of them.
+        state = engine.state
+        loss, steps = self._accelerator.reduce(
+            torch.stack(
+                [
+                    state.metrics["_loss"],
+                    torch.tensor(float(state.epoch_iteration), device=self._accelerator.device),
+                ]
+            ),
+            reduction="sum",
+        )
+        if steps > 0:
+            state.metrics["loss"] = loss / steps
+
+
+class FastTrainer(Trainer):
+    """
+    Trainer with a plain loop that dispatches iteration events every `every` steps.
+
+    Epoch level events fire as usual. Per-step forward and iteration events are replaced
+    with a single FORWARD_COMPLETED and ITERATION_COMPLETED every `every` steps
+    (and at the end of an epoch) with `state.batch` and `state.output`
+    concatenated over the skipped steps, so metrics still see every sample exactly once.
+    `state.iteration` moves by `state.iteration_steps` on every event, so handlers that should
+    run every N iterations are filtered with `every_iterations` instead of `every=N`.
+    """
+
+    def __init__(
+        self,
+        model: torch.nn.Module,
+        optimizer: torch.optim.Optimizer,
+        accelerator: "Accelerator",
+        every: int = 50,
+    ) -> None:
+        super().__init__(model, optimizer=optimizer, accelerator=accelerator)
+        self._every = every
+
+    def run(
+        self, loaders: dict[str, DataLoader], max_iters: dict[str, int], epochs: int | None = None
+    ) -> State:
+        self._loaders = loaders
+        self._max_iters = max_iters
+        if not self._finished(epochs or 1):
+            self._run_engine("train", epochs=epochs or 1)
+        return self.engines["eval"].state if "eval" in loaders else self.engines["train"].state
+
+    def _run_eval(self) -> None:
+        if self._loaders.get("eval") is None or self.engines["train"].state.resumed:
+            return
+        self._run_engine("eval", epochs=1)
+
+    def _run_engine(self, key: str, epochs: int) -> None:
+        engine, loader = self.engines[key], self._loaders[key]
+        step = self._train_step if key == "train" else self._eval_step
+        state = engine.state
+        # Like Engine.run, a state loaded from a checkpoint continues unless it is done.
+        if state.max_epochs is None or state.epoch >= state.max_epochs:
+            state.epoch = state.iteration = 0
+        state.dataloader, state.max_epochs = loader, epochs
+        state.epoch_length = self._max_iters.get(key) or _get_length(loader)
+        engine.should_terminate = engine.should_interrupt = False
+        engine.fire_event(Events.STARTED)
+        while state.epoch < epochs and not self._should_stop(engine):
+            state.epoch += 1
+            engine.should_terminate_single_epoch = False
+            engine.fire_event(Events.EPOCH_STARTED)
+            steps = []
+            # A resumed epoch keeps iterations done before the checkpoint.
+            max_iters = self._max_iters.get(key)
+            if max_iters is not None:
+                max_iters -= state.epoch_iteration
+            for batch in islice(loader, max_iters):
+                output = step(engine, batch)
+                steps.append((batch, {k: v.detach() for k, v in output.items()}))
+                state.iteration += 1
+                state.epoch_iteration += 1
+                if len(steps) < self._every:
+                    continue
+                self._flush(engine, steps)
+                steps = []
+                if self._should_stop(engine) or engine.should_terminate_single_epoch:
+                    break
+            if len(steps) > 0:
+                self._flush(engine, steps)
+            engine.fire_event(Events.EPOCH_COMPLETED)
+        engine.fire_event(Events.COMPLETED)
+
+    def _fire_step_event(self, engine: Engine, event: ModelEvents) -> None:
+        # Step events are replaced with a single FORWARD_COMPLETED in _flush.
+        pass
+
+    def _flush(
+        self, engine: Engine, steps: list[tuple[dict[str, torch.Tensor], dict[str, torch.Tensor]]]
+    ) -> None:
+        engine.state.iteration_steps = len(steps)
+        engine.state.batch = _concat([batch for batch, _ in steps])
+        engine.state.output = _concat([output for _, output in steps])
+        engine.fire_event(ModelEvents.FORWARD_COMPLETED)
+        engine.fire_event(Events.ITERATION_COMPLETED)
+
+    def _update_iteration(self, engine: Engine) -> None:
+        # Iterations are counted in the loop as events fire once per `every` steps.
+        pass
+
+    @staticmethod
+    def _should_stop(engine: Engine) -> bool:
+        return engine.should_terminate or engine.should_interrupt
+
+
+class ResumableState:
+    """
+    Checkpointing adapter for an engine that restores it in the middle of an epoch.
+
+    Engine.load_state_dict needs the epoch length, which is unknown for iterable datasets
+    during the first epoch, so the state is set directly. A state restored in the middle
+    of an epoch is marked as resumed: the next EPOCH_STARTED continues it without evaluation
+    and without resetting loss and metrics, and the loop skips iterations done before.
+    """
+
+    def __init__(self, engine: Engine) -> None:
+        self.engine = engine
+
+    def state_dict(self) -> dict[str, Any]:
+        return dict(self.engine.state_dict())
+
+    def load_state_dict(self, state_dict: dict[str, Any]) -> None:
+        state = self.engine.state
+        for key, value in state_dict.items():
+            setattr(state, key, value)
+        if state.epoch_length is None:
+            state.epoch, done = 0, state.iteration
+        else:
+            state.epoch, done = divmod(state.iteration, state.epoch_length)
+        state.resumed = done > 0
+
+
+def every_iterations(every: int) -> Callable[[Engine, int], bool]:
+    """
+    Event filter of ITERATION_COMPLETED that fires once a multiple of `every` is passed.
+
+    Unlike `Events.ITERATION_COMPLETED(every=every)` it does not need the iteration to be
+    a multiple itself, so it fires as often with FastTrainer, which completes
+    `state.iteration_steps` iterations per event, as with Trainer.
+    """
+
+    def event_filter(engine: Engine, iteration: int) -> bool:
+        return iteration // every > (iteration - engine.state.iteration_steps) // every
+
+    return event_filter
+
+
+def _get_length(loader: Any) -> int | None:
+    try:
+        return len(loader)
+    except TypeError:
+        return None
+
+
+def _concat(tensors: list[dict[str, torch.Tensor]]) -> dict[str, torch.Tensor]:
+    return {key: _concat_key(key, [t[key] for t in tensors]) for key in tensors[0]}
+
+
+def _concat_key(key: str, parts: list[torch.Tensor]) -> torch.Tensor:
+    if parts[0].dim() == 0:
+        return torch.stack(parts).mean()
+    if not key.endswith("_offsets"):
+        return torch.cat(parts)
+    # CSR offsets of sparse fields end with the number of non-zeros of a batch,
+    # so offsets of the next one continue from it without their leading zero.
+    shifted, total = [parts[0]], parts[0][-1]
+    for part in parts[1:]:
+        shifted.append(part[1:] + total)
+        total = total + part[-1]
+    return torch.cat(shifted)
@@ -1,4 +1,6 @@
 from typing import Any
+import os
+from pathlib import Path
 
 SPLITTER = "."
 
@@ -37,3 +39,17 @@ def merge_configs(*configs: dict[str, Any]) -> dict[str, Any]:
     for c in configs:
         config |= flatten_config(c)
     return unflatten_config(config)
+
+
+def load_config(path: Path, extra_vars: dict[str, Any] | None = None) -> dict[str, Any]:
+    from jinja2 import StrictUndefined, Template
+    import yaml
+
+    with path.open("r", encoding="utf-8") as file:
+        tmpl = Template(file.read(), undefined=StrictUndefined, autoescape=True)
+        return yaml.safe_load(tmpl.render(**(extra_vars or {})))
+
+
+def is_main_process() -> bool:
+    # RANK is set by torchrun and accelerate launch, so it is known before any process group exists.
+    return int(os.getenv("RANK", "0")) == 0
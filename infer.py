@@ -1,20 +1,13 @@
+from typing import Any
 import csv
 from io import TextIOWrapper
 from pathlib import Path
 import sys
 
-from accelerate import Accelerator
 import click
-from hydra.utils import instantiate
-from ignite.handlers import EpochOutputStore
-from jinja2 import StrictUndefined, Template
-from rich.console import Console
-from safetensors.torch import load_model
-import torch
-import yaml
 
 from experiments.click_options import State, extra_vars_option, name_option, pass_state
-from experiments.trainer import Trainer
+from experiments.utils import load_config
 
 
 @click.command(
@@ -30,11 +23,24 @@ from experiments.trainer import Trainer
 )
 @click.option(
     "--model-path",
-    help="Model path.",
+    help="Model path. Repeat it to score an ensemble of checkpoints in a single pass.",
     type=click.Path(exists=True, dir_okay=False, path_type=Path),
-    default=Path.cwd() / "my-model/best_iteration/model.safetensors",
+    multiple=True,
+    default=[Path.cwd() / "my-model/best_iteration/model.safetensors"],
     show_default=True,
 )
+@click.option(
+    "--ensemble",
+    help="How to combine predictions of several checkpoints: average probabilities or vote.",
+    type=click.Choice(["mean", "vote"]),
+    default="mean",
+    show_default=True,
+)
+@click.option(
+    "--member-probs",
+    is_flag=True,
+    help="Also write the probability of the label from every checkpoint (prob_0, prob_1, ...).",
+)
 @click.option(
     "-o",
     "--out",
@@ -46,29 +52,66 @@ from experiments.trainer import Trainer
 @name_option("exp")
 @extra_vars_option
 @pass_state
-@torch.no_grad()
-def main(state: State, config_path: Path, model_path: Path, out: TextIOWrapper) -> None:
+def main(
+    state: State,
+    config_path: Path,
+    model_path: tuple[Path, ...],
+    ensemble: str,
+    member_probs: bool,
+    out: TextIOWrapper,
+) -> None:
+    from accelerate import Accelerator
+    from hydra.utils import instantiate
+    from ignite.handlers import EpochOutputStore
+    from rich.console import Console
+    from safetensors.torch import load_model
+    import torch
+
+    from experiments.options import attach_memory_monitor
+    from experiments.trainer import Trainer
+    from movs_mlops_2023.models import ClassificationEnsemble
+
+    torch.set_grad_enabled(False)
     console = Console(file=sys.stderr)
-    with config_path.open("r", encoding="utf-8") as file:
-        tmpl = Template(file.read(), undefined=StrictUndefined, autoescape=True)
-        config = yaml.safe_load(tmpl.render(**(state.extra_vars or {})))
+    config = load_config(config_path, extra_vars=state.extra_vars)
+    if config.get("num_threads", 0) > 0:
+        torch.set_num_threads(config["num_threads"])
     accelerator = Accelerator()
     console.print_json(data=config)
-    model = instantiate(config["model"])
-    load_model(model, model_path)
+    models = []
+    for path in model_path:
+        models.append(instantiate(config["model"]))
+        load_model(models[-1], path)
+    model = models[0] if len(models) == 1 else ClassificationEnsemble(models, reduction=ensemble)
     model, dataset = accelerator.prepare(model, instantiate(config["dataset"], shuffle=False))
     trainer = Trainer(model=model, optimizer=None, accelerator=accelerator)
-    EpochOutputStore().attach(trainer.engines["eval"], name="result")
+    outputs = EpochOutputStore()
+    outputs.attach(trainer.engines["eval"], name="result")
+    if (memory := config.get("memory", {})).pop("enabled", False):
+        attach_memory_monitor(
+            trainer, accelerator, loaders={"eval": dataset}, outputs=[outputs], **memory
+        )
     state = trainer.engines["eval"].run(dataset)
-    # Write result
+    write_results(out, state.result, members=len(models) if member_probs and len(models) > 1 else 0)
+
+
+def write_results(out: TextIOWrapper, results: list[dict[str, Any]], members: int = 0) -> None:
+    import torch
+
     sample_id = 0
-    out_writer = csv.DictWriter(out, fieldnames=("id", "prob", "label"))
+    fieldnames = ["id", "prob", "label"] + [f"prob_{i}" for i in range(members)]
+    out_writer = csv.DictWriter(out, fieldnames=fieldnames)
     out_writer.writeheader()
-    for r in state.result:
+    for r in results:
         labels = r["logits"].argmax(dim=-1)
-        probs = r["probs"][torch.arange(r["probs"].size(0)), labels]
+        rows = torch.arange(r["probs"].size(0))
+        probs = r["probs"][rows, labels].unsqueeze(-1)
+        if members > 0:
+            probs = torch.cat((probs, r["member_probs"][rows, :, labels]), dim=-1)
         for p, l in zip(probs.cpu().numpy().tolist(), labels.cpu().numpy().tolist(), strict=True):
-            out_writer.writerow({"id": sample_id, "prob": round(p, 4), "label": l})
+            row = {"id": sample_id, "prob": round(p[0], 4), "label": l}
+            row |= {f"prob_{i}": round(m, 4) for i, m in enumerate(p[1:])}
+            out_writer.writerow(row)
             sample_id += 1
 
 
@@ -0,0 +1,141 @@
+from typing import IO, Callable, Iterator
+from functools import partial
+import io
+import struct
+import zlib
+
+GZIP_MAGIC = b"\x1f\x8b"
+# Gzip magic, deflate and a flag of extra fields.
+_MAGIC = GZIP_MAGIC + b"\x08\x04"
+# Inputs of bgzip blocks are limited so that even incompressible ones fit 64KB with headers.
+BLOCK_SIZE = 65280
+EOF_BLOCK = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+# Magic, mtime, extra flags, OS, extra length, BC subfield id, its length and block size - 1.
+_HEADER = struct.Struct("<4sIBBH2sHH")
+_FOOTER = struct.Struct("<II")  # crc32, input size
+
+
+class Writer(io.RawIOBase):
+    """
+    Compress a binary stream into BGZF blocks that hold whole lines.
+
+    BGZF is a concatenation of gzip members with their sizes in headers,
+    so it is read by gzip as a single stream, and readers of lines can hop between
+    members and decompress some of them only. The underlying file is not closed.
+    """
+
+    def __init__(
+        self, file: IO[bytes], block_size: int = BLOCK_SIZE, compresslevel: int = 6
+    ) -> None:
+        super().__init__()
+        self._file = file
+        self._block_size = block_size
+        self._compresslevel = compresslevel
+        self._buffer = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:  # type: ignore[override]
+        self._buffer += data
+        while len(self._buffer) >= self._block_size:
+            if (end := self._buffer.rfind(b"\n", 0, self._block_size) + 1) == 0:
+                raise ValueError(f"Lines longer than {self._block_size} bytes do not fit a block")
+            self._write_block(self._buffer[:end])
+            del self._buffer[:end]
+        return len(data)
+
+    def close(self) -> None:
+        if not self.closed:
+            if len(self._buffer) > 0:
+                self._write_block(self._buffer)
+                self._buffer.clear()
+            self._file.write(EOF_BLOCK)
+            self._file.flush()
+        super().close()
+
+    def _write_block(self, data: bytes) -> None:
+        compressor = zlib.compressobj(self._compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+        body = compressor.compress(data) + compressor.flush()
+        size = _HEADER.size + len(body) + _FOOTER.size
+        self._file.write(_HEADER.pack(_MAGIC, 0, 0, 0xFF, 6, b"BC", 2, size - 1))
+        self._file.write(body)
+        self._file.write(_FOOTER.pack(zlib.crc32(data), len(data)))
+
+
+def is_gzip(file: IO[bytes]) -> bool:
+    return _peek(file, len(GZIP_MAGIC)) == GZIP_MAGIC
+
+
+def is_bgzf(file: IO[bytes]) -> bool:
+    header = _peek(file, _HEADER.size)
+    return len(header) == _HEADER.size and header[:4] == _MAGIC and header[12:14] == b"BC"
+
+
+def blocks(file: IO[bytes], offset: int = 0) -> Iterator[tuple[int, int, Callable[[], bytes]]]:
+    """
+    Read headers of BGZF blocks from the current position of a file.
+
+    Parameters
+    ----------
+    file: IO[bytes]
+        BGZF file opened in binary mode. Data of blocks is skipped by seeking if possible.
+    offset: int (default = 0)
+        Offset of the current position in the file.
+
+    Returns
+    -------
+    Iterator[tuple[int, int, Callable[[], bytes]]]
+        Offsets and sizes of blocks and functions to decompress them.
+        A function should be called before moving to the next block.
+    """
+    seekable = file.seekable()
+    while len(fixed := file.read(12)) > 0:
+        if len(fixed) < 12 or fixed[:4] != _MAGIC:
+            raise ValueError(f"No BGZF block at offset {offset}")
+        extra = file.read(int.from_bytes(fixed[10:12], "little"))
+        size, header_size = _block_size(extra, offset) + 1, 12 + len(extra)
+        body = None if seekable else file.read(size - header_size)
+        yield offset, size, partial(
+            _read_block, file, offset + header_size, size - header_size, body
+        )
+        offset += size
+        if seekable:
+            file.seek(offset)
+
+
+def read_block(file: IO[bytes], offset: int) -> bytes:
+    """Decompress a BGZF block at an offset of a seekable file."""
+    file.seek(offset)
+    _, _, read = next(blocks(file, offset=offset))
+    return read()
+
+
+def _block_size(extra: bytes, offset: int) -> int:
+    pos = 0
+    while pos + 4 <= len(extra):
+        length = int.from_bytes(extra[pos + 2 : pos + 4], "little")
+        if extra[pos : pos + 2] == b"BC" and length == 2:
+            return int.from_bytes(extra[pos + 4 : pos + 6], "little")
+        pos += 4 + length
+    raise ValueError(f"Gzip member at offset {offset} has no BGZF block size")
+
+
+def _read_block(file: IO[bytes], offset: int, size: int, body: bytes | None) -> bytes:
+    if body is None:
+        file.seek(offset)
+        body = file.read(size)
+    data = zlib.decompress(body[: -_FOOTER.size], wbits=-zlib.MAX_WBITS)
+    crc, length = _FOOTER.unpack(body[-_FOOTER.size :])
+    if len(data) != length or zlib.crc32(data) != crc:
+        raise ValueError(f"BGZF block at offset {offset} is corrupted")
+    return data
+
+
+def _peek(file: IO[bytes], size: int) -> bytes:
+    if hasattr(file, "peek"):
+        return file.peek(size)[:size]
+    position = file.tell()
+    data = file.read(size)
+    file.seek(position)
+    return data
@@ -0,0 +1,137 @@
+from typing import Any, Iterable, Iterator
+from pathlib import Path
+import tempfile
+import warnings
+
+import torch
+from torch.utils.data import RandomSampler
+
+_ALIGNMENT = 64
+
+
+class Cached:
+    """
+    Keep collated batches of the first complete pass over a loader to serve later passes.
+
+    Batches should be dictionaries of tensors. They are kept in memory or, with `mmap_dir`,
+    written to a file there and memory-mapped back, so pages are loaded on demand and
+    can be dropped by the OS. A pass that is stopped early is not cached. If batches
+    take more than `max_size_mb`, caching is turned off and every pass reads the loader.
+    Shuffled loaders can not be cached as later passes would repeat the first order.
+    """
+
+    def __init__(
+        self,
+        loader: Iterable[dict[str, torch.Tensor]],
+        max_size_mb: float | None = None,
+        mmap_dir: Path | str | None = None,
+    ) -> None:
+        if is_shuffled(loader):
+            raise ValueError("Cached works with loaders that are not shuffled")
+        self.loader = loader
+        self.size = 0
+        self._max_size = max_size_mb * 2**20 if max_size_mb is not None else None
+        self._mmap_dir = mmap_dir
+        self._batches: list[dict[str, torch.Tensor]] | None = None
+        self._disabled = False
+
+    @property
+    def cached(self) -> bool:
+        return self._batches is not None
+
+    def __len__(self) -> int:
+        if self._batches is not None:
+            return len(self._batches)
+        return len(self.loader)  # type: ignore[arg-type]
+
+    def __iter__(self) -> Iterator[dict[str, torch.Tensor]]:
+        if self._batches is not None:
+            yield from self._batches
+            return
+        if self._disabled:
+            yield from self.loader
+            return
+        yield from self._fill()
+
+    def _fill(self) -> Iterator[dict[str, torch.Tensor]]:
+        writer = _MmapWriter(self._mmap_dir) if self._mmap_dir is not None else None
+        batches, size = [], 0
+        try:
+            for batch in self.loader:
+                if not self._disabled:
+                    size += sum(t.nelement() * t.element_size() for t in batch.values())
+                    if self._max_size is not None and size > self._max_size:
+                        warnings.warn(
+                            f"Batches take more than {self._max_size / 2**20:.1f}MB, "
+                            "caching is off",
+                            stacklevel=2,
+                        )
+                        self._disabled, batches = True, []
+                    else:
+                        # Stored before the consumer gets a chance to change the batch.
+                        batches.append(writer.write(batch) if writer is not None else dict(batch))
+                yield batch
+            if not self._disabled:
+                self._batches = writer.read(batches) if writer is not None else batches
+                self.size = size
+        finally:
+            if writer is not None:
+                writer.close()
+
+
+class _MmapWriter:
+    """Append tensors to a temporary file and map them back as views of a single storage."""
+
+    def __init__(self, dir: Path | str) -> None:
+        Path(dir).mkdir(parents=True, exist_ok=True)
+        # The file is unlinked on close, the mapping keeps its pages alive.
+        self._file = tempfile.NamedTemporaryFile(dir=dir, suffix=".batches")  # noqa: SIM115
+        self._offset = 0
+
+    def write(self, batch: dict[str, torch.Tensor]) -> dict[str, tuple[int, torch.dtype, Any]]:
+        layout = {}
+        for key, tensor in batch.items():
+            data = tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy()
+            padding = -self._offset % _ALIGNMENT
+            self._file.write(b"\0" * padding + data.tobytes())
+            self._offset += padding
+            layout[key] = (self._offset, tensor.dtype, tensor.shape)
+            self._offset += data.nbytes
+        return layout
+
+    def read(
+        self, layouts: list[dict[str, tuple[int, torch.dtype, Any]]]
+    ) -> list[dict[str, torch.Tensor]]:
+        self._file.flush()
+        if self._offset == 0:
+            return [{} for _ in layouts]
+        storage = torch.UntypedStorage.from_file(self._file.name, shared=False, nbytes=self._offset)
+        data = torch.empty(0, dtype=torch.uint8).set_(storage)
+        return [
+            {
+                key: data[offset : offset + _nbytes(dtype, shape)].view(dtype).view(shape)
+                for key, (offset, dtype, shape) in layout.items()
+            }
+            for layout in layouts
+        ]
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def is_shuffled(loader: Any) -> bool:
+    """Check if a loader, possibly wrapped by Prefetcher or prepared by accelerate, shuffles."""
+    # Prefetcher keeps the wrapped loader, accelerate moves the sampler into its batch sampler.
+    while (
+        inner := getattr(loader, "base_dataloader", getattr(loader, "loader", None))
+    ) is not None:
+        loader = inner
+    samplers = (
+        getattr(loader, "sampler", None),
+        getattr(getattr(loader, "batch_sampler", None), "sampler", None),
+    )
+    return any(isinstance(s, RandomSampler) for s in samplers)
+
+
+def _nbytes(dtype: torch.dtype, shape: torch.Size) -> int:
+    return shape.numel() * dtype.itemsize
@@ -1,26 +1,38 @@
 from typing import Any
 from collections import defaultdict
+from itertools import accumulate, chain
 
 import torch
 from torch.nn.utils.rnn import pad_sequence
 
 
 class Default:
+    """
+    Stack fields of samples into tensors.
+
+    Fields in `pad` are padded to the longest sample and get masks. Fields of sparse rows,
+    `{"indices": [...], "values": [...]}`, are packed into `{field}_indices`, `{field}_values`
+    and CSR `{field}_offsets` with the total number of non-zeros at the end.
+    Values may be omitted for rows of ones.
+    """
+
     def __init__(self, pad: list[str] | None = None, padding_value: float = 0) -> None:
         self._pad = set(pad or [])
         self._padding_value = padding_value
 
     def __call__(self, instances: list[dict[str, Any]]) -> dict[str, torch.Tensor]:
-        batch = {
-            key: pad_sequence(
-                [torch.as_tensor(t) for t in tensor],
-                batch_first=True,
-                padding_value=self._padding_value,
-            )
-            if key in self._pad
-            else torch.tensor(tensor)
-            for key, tensor in self._make_batch(instances).items()
-        }
+        batch = {}
+        for key, tensor in self._make_batch(instances).items():
+            if isinstance(tensor[0], dict):
+                batch |= _pack_sparse(key, tensor)
+            elif key in self._pad:
+                batch[key] = pad_sequence(
+                    [torch.as_tensor(t) for t in tensor],
+                    batch_first=True,
+                    padding_value=self._padding_value,
+                )
+            else:
+                batch[key] = torch.tensor(tensor)
         for key in self._pad:
             batch[f"{key}_mask"] = batch[key].ne(self._padding_value).float()
         return batch
@@ -32,3 +44,15 @@ class Default:
             for field, tensor in instance.items():
                 tensor_dict[field].append(tensor)
         return tensor_dict
+
+
+def _pack_sparse(key: str, rows: list[dict[str, list[Any]]]) -> dict[str, torch.Tensor]:
+    if any("values" in r and len(r["values"]) != len(r["indices"]) for r in rows):
+        raise ValueError(f"Sparse rows of {key} should have as many values as indices")
+    indices = torch.tensor(list(chain.from_iterable(r["indices"] for r in rows)), dtype=torch.long)
+    values = torch.tensor(
+        list(chain.from_iterable(r.get("values") or [1.0] * len(r["indices"]) for r in rows)),
+        dtype=torch.float,
+    )
+    offsets = torch.tensor(list(accumulate((len(r["indices"]) for r in rows), initial=0)))
+    return {f"{key}_indices": indices, f"{key}_values": values, f"{key}_offsets": offsets}
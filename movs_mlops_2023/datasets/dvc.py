@@ -1,21 +1,27 @@
-from typing import Any, Iterator
-from itertools import islice
-import json
+from typing import IO, ContextManager
 from pathlib import Path
 
 import dvc.api
-from torch.utils.data import IterableDataset, get_worker_info
 
+from movs_mlops_2023.datasets.sharding import ShardedLines
 
-class Iter(IterableDataset):
-    def __init__(self, path: Path | str) -> None:
+
+class Iter(ShardedLines):
+    def __init__(
+        self,
+        path: Path | str,
+        repo: str | None = None,
+        remote: str | None = None,
+        track_position: bool = False,
+    ) -> None:
+        super().__init__(track_position=track_position)
         self._path = Path(path)
+        self._repo = repo
+        self._remote = remote
+
+    @property
+    def source(self) -> str:
+        return str(self._path)
 
-    def __iter__(self) -> Iterator[dict[str, Any]]:
-        worker_info = get_worker_info()
-        with dvc.api.open(str(self._path), mode="r", encoding="utf-8") as file:
-            start, step = 0, 1
-            if worker_info is not None and worker_info.num_workers > 0:
-                start, step = worker_info.id, worker_info.num_workers
-            lines = islice(file, start, None, step)
-            yield from map(json.loads, lines)
+    def _open(self) -> ContextManager[IO[bytes]]:
+        return dvc.api.open(str(self._path), repo=self._repo, remote=self._remote, mode="rb")
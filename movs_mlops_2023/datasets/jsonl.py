@@ -1,14 +1,18 @@
-from typing import Any, Iterator
-from itertools import islice
+from typing import IO, Any
+import gzip
 import json
 from pathlib import Path
 
-from torch.utils.data import Dataset, IterableDataset, get_worker_info
+from torch.utils.data import Dataset
+
+from movs_mlops_2023.datasets import bgzf
+from movs_mlops_2023.datasets.sharding import ShardedLines
 
 
 class InMemory(Dataset):
     def __init__(self, path: Path | str) -> None:
-        with Path(path).open("r", encoding="utf-8") as file:
+        with Path(path).open("rb") as raw:
+            file = gzip.GzipFile(fileobj=raw, mode="rb") if bgzf.is_gzip(raw) else raw
             self._samples = [json.loads(line) for line in file]
 
     def __len__(self) -> int:
@@ -18,15 +22,14 @@ class InMemory(Dataset):
         return self._samples[idx]
 
 
-class Iter(IterableDataset):
-    def __init__(self, path: Path | str) -> None:
+class Iter(ShardedLines):
+    def __init__(self, path: Path | str, track_position: bool = False) -> None:
+        super().__init__(track_position=track_position)
         self._path = Path(path)
 
-    def __iter__(self) -> Iterator[dict[str, Any]]:
-        worker_info = get_worker_info()
-        with self._path.open("r", encoding="utf-8") as file:
-            start, step = 0, 1
-            if worker_info is not None and worker_info.num_workers > 0:
-                start, step = worker_info.id, worker_info.num_workers
-            lines = islice(file, start, None, step)
-            yield from map(json.loads, lines)
+    @property
+    def source(self) -> str:
+        return str(self._path)
+
+    def _open(self) -> IO[bytes]:
+        return self._path.open("rb")
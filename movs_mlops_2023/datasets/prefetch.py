@@ -0,0 +1,92 @@
+from typing import Any, Iterable, Iterator
+from dataclasses import dataclass
+import queue
+import threading
+import time
+
+_END = object()
+
+
+@dataclass
+class PrefetchStats:
+    batches: int = 0
+    wait_time: float = 0.0
+    depth: int = 0
+
+    @property
+    def mean_depth(self) -> float:
+        return self.depth / self.batches if self.batches > 0 else 0.0
+
+
+class _Failure:
+    def __init__(self, exc: BaseException) -> None:
+        self.exc = exc
+
+
+class Prefetcher:
+    """
+    Iterate over a loader in a background thread keeping up to `size` batches ready.
+
+    Reading, parsing and collation of the next batches overlap with the training step
+    without spawning DataLoader worker processes for every pass.
+    """
+
+    def __init__(self, loader: Iterable[Any], size: int = 2) -> None:
+        if size < 1:
+            raise ValueError(f"size must be positive (size={size})")
+        self.loader = loader
+        self.stats = PrefetchStats()
+        self._size = size
+
+    def __len__(self) -> int:
+        return len(self.loader)  # type: ignore[arg-type]
+
+    def __iter__(self) -> Iterator[Any]:
+        batches: queue.Queue = queue.Queue(maxsize=self._size)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._produce, args=(batches, stop), daemon=True)
+        thread.start()
+        try:
+            while True:
+                depth = batches.qsize()
+                start = time.perf_counter()
+                item = batches.get()
+                if item is _END:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.exc
+                self.stats.wait_time += time.perf_counter() - start
+                self.stats.depth += depth
+                self.stats.batches += 1
+                yield item
+        finally:
+            stop.set()
+            # Unblock the producer if the consumer stopped before the end of the loader.
+            while thread.is_alive():
+                try:
+                    batches.get_nowait()
+                except queue.Empty:
+                    thread.join(timeout=0.01)
+
+    def reset_stats(self) -> None:
+        self.stats = PrefetchStats()
+
+    def _produce(self, batches: queue.Queue, stop: threading.Event) -> None:
+        try:
+            for batch in self.loader:
+                if not self._put(batches, batch, stop):
+                    return
+        except Exception as e:  # noqa: BLE001
+            self._put(batches, _Failure(e), stop)
+            return
+        self._put(batches, _END, stop)
+
+    @staticmethod
+    def _put(batches: queue.Queue, item: Any, stop: threading.Event) -> bool:
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
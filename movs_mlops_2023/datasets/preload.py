@@ -0,0 +1,49 @@
+from typing import Iterable, Iterator
+import math
+
+import torch
+
+from movs_mlops_2023.datasets.cache import is_shuffled
+
+
+class Preloaded:
+    """
+    Collate the whole loader once and serve batches by slicing the stacked tensors.
+
+    Every field of the collated batches should have the same shape except for the first dimension.
+    Batches are shuffled with index-based batching if the loader uses a random sampler.
+    """
+
+    def __init__(
+        self,
+        loader: Iterable[dict[str, torch.Tensor]],
+        batch_size: int | None = None,
+        shuffle: bool | None = None,
+        generator: torch.Generator | None = None,
+    ) -> None:
+        batches = list(loader)
+        if len(batches) == 0:
+            raise ValueError("loader is empty")
+        self._tensors = {key: torch.cat([b[key] for b in batches]) for key in batches[0]}
+        if len({t.size(0) for t in self._tensors.values()}) > 1:
+            raise ValueError("Preloaded does not support sparse features")
+        self._size = next(iter(self._tensors.values())).size(0)
+        self._batch_size = (
+            batch_size
+            or getattr(loader, "batch_size", None)
+            or next(iter(batches[0].values())).size(0)
+        )
+        self._shuffle = shuffle if shuffle is not None else is_shuffled(loader)
+        self._generator = generator
+
+    def __len__(self) -> int:
+        return math.ceil(self._size / self._batch_size)
+
+    def __iter__(self) -> Iterator[dict[str, torch.Tensor]]:
+        if not self._shuffle:
+            for start in range(0, self._size, self._batch_size):
+                yield {k: t[start : start + self._batch_size] for k, t in self._tensors.items()}
+            return
+        indices = torch.randperm(self._size, generator=self._generator)
+        for idx in indices.split(self._batch_size):
+            yield {k: t[idx] for k, t in self._tensors.items()}
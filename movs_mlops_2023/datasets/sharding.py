@@ -0,0 +1,400 @@
+from typing import IO, Any, ContextManager, Iterable, Iterator
+from abc import abstractmethod
+from collections import deque
+import gzip
+import io
+from itertools import islice, takewhile
+import json
+import os
+import random
+
+import torch
+import torch.distributed as dist
+from torch.utils.data import IterableDataset, get_worker_info
+
+from movs_mlops_2023.datasets import bgzf
+
+POSITION_KEY = "_position"
+# Positions in BGZF files keep offsets of blocks above these bits and offsets within blocks below.
+VIRTUAL_SHIFT = 16
+
+
+def get_shard() -> tuple[int, int]:
+    """
+    Get offset and step of a shard for the current distributed rank and DataLoader worker.
+
+    Returns
+    -------
+    tuple[int, int]
+        Index of the first sample in a shard and step between samples.
+    """
+    if dist.is_available() and dist.is_initialized():
+        rank, world_size = dist.get_rank(), dist.get_world_size()
+    else:
+        rank, world_size = int(os.getenv("RANK", "0")), int(os.getenv("WORLD_SIZE", "1"))
+    worker_id, num_workers = 0, 1
+    if (worker_info := get_worker_info()) is not None and worker_info.num_workers > 0:
+        worker_id, num_workers = worker_info.id, worker_info.num_workers
+    return rank * num_workers + worker_id, world_size * num_workers
+
+
+class ShardedLines(IterableDataset):
+    """
+    Parse JSON lines of the shard of a file for the current rank and DataLoader worker.
+
+    With `track_position` every sample gets `_position` with the shard index, the number
+    of shards and the byte offset right after its line. Offsets passed to `resume` make
+    the next pass start every shard after them, so an interrupted epoch can continue
+    without reading the consumed part of the stream again.
+
+    `select` limits passes to a byte range of an append-only file, so training can continue
+    on the rows appended since a previous run with a bounded sample of the older ones.
+
+    Gzip files are decompressed on the fly. BGZF files written by `bgzf.Writer` are split
+    between shards by blocks, so every DataLoader worker decompresses only its blocks.
+    Their offsets count compressed bytes and positions are BGZF virtual offsets.
+    """
+
+    def __init__(self, track_position: bool = False) -> None:
+        self.track_position = track_position
+        self.start, self.stop = 0, None
+        self.replay, self.replay_seed = 0, 0
+        self._offsets: dict[int, int] = {}
+        self._num_shards: int | None = None
+
+    @property
+    @abstractmethod
+    def source(self) -> str:
+        pass
+
+    @abstractmethod
+    def _open(self) -> ContextManager[IO[bytes]]:
+        pass
+
+    def size(self) -> int:
+        """Current size of the file in bytes. Gzip files other than BGZF are decompressed."""
+        if (size := self.known_size()) is not None:
+            return size
+        with self._open() as opened:
+            raw = _peekable(opened)
+            file = raw if bgzf.is_bgzf(raw) else _decompressed(raw)
+            size = 0
+            while chunk := file.read(2**20):
+                size += len(chunk)
+            return size
+
+    def known_size(self) -> int | None:
+        """
+        Size of the file in bytes if it is known without reading the file.
+
+        It is known for seekable files that are not compressed by plain gzip, otherwise None.
+        """
+        with self._open() as raw:
+            if not raw.seekable() or (bgzf.is_gzip(raw) and not bgzf.is_bgzf(raw)):
+                return None
+            return raw.seek(0, os.SEEK_END)
+
+    def select(
+        self, start: int = 0, stop: int | None = None, replay: int = 0, seed: int = 0
+    ) -> None:
+        """
+        Read lines in a byte range of the file and mix in a sample of lines before it.
+
+        Parameters
+        ----------
+        start: int (default = 0)
+            Byte offset of the first line to read, it should be at the beginning of a line.
+        stop: int | None (default = None)
+            Byte offset to read up to. Lines that end after it are skipped,
+            so rows appended during training do not change epochs. The end of file by default.
+        replay: int (default = 0)
+            Maximum number of lines before `start` to sample and spread over every pass.
+            They are found by seeking to random offsets or BGZF blocks, so longer lines
+            or lines of smaller blocks are sampled a bit more often than others,
+            and the file should be seekable and not compressed by plain gzip.
+        seed: int (default = 0)
+            Seed of the replay sample. It is the same on all passes and shards.
+        """
+        self.start, self.stop, self.replay, self.replay_seed = start, stop, replay, seed
+
+    def resume(self, offsets: dict[int, int], num_shards: int | None = None) -> None:
+        """
+        Start the next pass of every shard after its offset.
+
+        Parameters
+        ----------
+        offsets: dict[int, int]
+            Byte offset after the last consumed line by shard index.
+            Shards without an offset start from the beginning.
+        num_shards: int | None (default = None)
+            Number of shards the offsets were recorded with.
+        """
+        self._offsets, self._num_shards = dict(offsets), num_shards
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        index, step = get_shard()
+        # Forked DataLoader workers keep their own copy, so offsets are used for one pass only.
+        offsets, self._offsets = self._offsets, {}
+        if len(offsets) > 0 and self._num_shards != step:
+            raise RuntimeError(
+                f"Can not resume {self._num_shards} shards with {step} shards, "
+                "use the same number of processes and DataLoader workers."
+            )
+        with self._open() as opened:
+            raw = _peekable(opened)
+            blocked = bgzf.is_bgzf(raw)
+            file = raw if blocked else _decompressed(raw)
+            if not blocked and not self.track_position and self._reads_all():
+                yield from map(json.loads, islice(file, index, None, step))
+                return
+            for offset, line in self._lines(file, index, step, offsets.get(index), blocked):
+                sample = json.loads(line)
+                if self.track_position:
+                    sample[POSITION_KEY] = [index, step, offset]
+                yield sample
+
+    def _reads_all(self) -> bool:
+        return self.start == 0 and self.stop is None and self.replay == 0
+
+    def _lines(
+        self,
+        file: IO[bytes],
+        index: int,
+        step: int,
+        offset: int | None = None,
+        blocked: bool = False,
+    ) -> Iterator[tuple[int, bytes]]:
+        shift = VIRTUAL_SHIFT if blocked else 0
+        start = self.start << shift
+        consumed = offset if offset is not None and offset > start else start
+        # A replay line follows the first line of the range that ends after its share
+        # of the range, so it carries a position that skips it after resuming.
+        replay = deque(
+            r for r in self._replay_lines(index, step) if r[0] >= (consumed >> shift) - self.start
+        )
+        for consumed, line in (read_block_shard if blocked else read_shard)(
+            file, index, step, offset=offset, start=self.start, stop=self.stop
+        ):
+            yield consumed, line
+            while len(replay) > 0 and replay[0][0] < (consumed >> shift) - self.start:
+                yield consumed, replay.popleft()[1]
+        for _, line in replay:
+            yield consumed, line
+
+    def _replay_lines(self, index: int, step: int) -> list[tuple[float, bytes]]:
+        if self.replay == 0 or self.start == 0:
+            return []
+        rng = random.Random(self.replay_seed)
+        with self._open() as file:
+            if not file.seekable() or (bgzf.is_gzip(file) and not bgzf.is_bgzf(file)):
+                raise RuntimeError(
+                    f"Replay needs a seekable plain or BGZF file, {self.source} is not"
+                )
+            sample = _sample_block_lines if bgzf.is_bgzf(file) else _sample_lines
+            lines = sample(file, self.start, self.replay, rng)
+        if len(lines) == 0:
+            return []
+        span = ((self.stop if self.stop is not None else self.start) - self.start) / len(lines)
+        return [(i * span, line) for i, line in enumerate(lines) if i % step == index]
+
+
+def read_shard(
+    file: IO[bytes],
+    index: int,
+    step: int,
+    offset: int | None = None,
+    start: int = 0,
+    stop: int | None = None,
+) -> Iterator[tuple[int, bytes]]:
+    """
+    Read lines of a shard from a binary file together with byte offsets after them.
+
+    Parameters
+    ----------
+    file: IO[bytes]
+        File opened in binary mode at its beginning.
+    index: int
+        Index of the shard.
+    step: int
+        Number of shards.
+    offset: int | None (default = None)
+        Byte offset after the last consumed line of the shard.
+        Reading continues from its next line which is `step` lines further.
+    start: int (default = 0)
+        Byte offset of the first line. Shards split lines counting from it.
+    stop: int | None (default = None)
+        Byte offset to read up to, lines ending after it are not read.
+
+    Returns
+    -------
+    Iterator[tuple[int, bytes]]
+        Byte offsets after lines and the lines.
+    """
+    first = index
+    if offset is not None and offset > start:
+        first = step - 1
+    else:
+        offset = start
+    if offset > 0:
+        _skip_bytes(file, offset)
+    for i, line in enumerate(file):
+        if stop is not None and offset + len(line) > stop:
+            return
+        offset += len(line)
+        if i % step == first:
+            yield offset, line
+
+
+def read_block_shard(
+    file: IO[bytes],
+    index: int,
+    step: int,
+    offset: int | None = None,
+    start: int = 0,
+    stop: int | None = None,
+) -> Iterator[tuple[int, bytes]]:
+    """
+    Read lines of a shard from a BGZF file together with virtual offsets after them.
+
+    Shards take every `step`-th block, and blocks of other shards are not decompressed.
+    Blocks should end with whole lines like the ones written by `bgzf.Writer`.
+
+    Parameters
+    ----------
+    file: IO[bytes]
+        BGZF file opened in binary mode at its beginning.
+    index: int
+        Index of the shard.
+    step: int
+        Number of shards.
+    offset: int | None (default = None)
+        Virtual offset after the last consumed line of the shard.
+    start: int (default = 0)
+        Offset of the first block. Shards split blocks counting from it.
+    stop: int | None (default = None)
+        Offset to read up to, blocks ending after it are not read.
+
+    Returns
+    -------
+    Iterator[tuple[int, bytes]]
+        Virtual offsets after lines and the lines.
+    """
+    resume = offset if offset is not None and offset > start << VIRTUAL_SHIFT else 0
+    resume_block, skip = resume >> VIRTUAL_SHIFT, resume & ((1 << VIRTUAL_SHIFT) - 1)
+    if start > 0:
+        _skip_bytes(file, start)
+    for i, (block_offset, size, read) in enumerate(bgzf.blocks(file, offset=start)):
+        if stop is not None and block_offset + size > stop:
+            return
+        if i % step != index or block_offset < resume_block:
+            continue
+        data = read()
+        if len(data) > 0 and data[-1:] != b"\n":
+            raise ValueError(
+                f"BGZF block at offset {block_offset} does not end with a whole line, "
+                "write files with bgzf.Writer"
+            )
+        position = skip if block_offset == resume_block else 0
+        lines = io.BytesIO(data)
+        lines.seek(position)
+        for line in lines:
+            position += len(line)
+            # The end of a block is the beginning of the next one, so positions stay in 16 bits.
+            yield (
+                (block_offset + size) << VIRTUAL_SHIFT
+                if position == len(data)
+                else block_offset << VIRTUAL_SHIFT | position
+            ), line
+
+
+def _sample_lines(file: IO[bytes], stop: int, size: int, rng: random.Random) -> list[bytes]:
+    positions = sorted(rng.randrange(stop) for _ in range(size))
+    starts, lines = set(), []
+    for position in positions:
+        # Skip to the beginning of the next line unless the position is one.
+        file.seek(max(position - 1, 0))
+        if position > 0:
+            file.readline()
+        if (line_start := file.tell()) >= stop or line_start in starts:
+            continue
+        starts.add(line_start)
+        lines.append(file.readline())
+    return lines
+
+
+def _sample_block_lines(file: IO[bytes], stop: int, size: int, rng: random.Random) -> list[bytes]:
+    found = [offset for offset, _, _ in takewhile(lambda b: b[0] < stop, bgzf.blocks(file))]
+    chosen = sorted({(rng.randrange(len(found)), rng.random()) for _ in range(size)})
+    seen, lines = set(), []
+    for block, share in chosen:
+        if len(data := io.BytesIO(bgzf.read_block(file, found[block])).readlines()) == 0:
+            continue
+        if (block, line := int(share * len(data))) not in seen:
+            seen.add((block, line))
+            lines.append(data[line])
+    return lines
+
+
+def _peekable(file: IO[bytes]) -> IO[bytes]:
+    # Formats are detected by peeking, streams from remotes can not seek back after reading,
+    # and their buffered readers peek only what a single read returns.
+    if file.seekable():
+        return file
+    return io.BufferedReader(_FullReads(file))
+
+
+class _FullReads(io.RawIOBase):
+    """Fill the whole buffer on every read, so that peeked headers are not cut short."""
+
+    def __init__(self, file: IO[bytes]) -> None:
+        super().__init__()
+        self._file = file
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        view, size = memoryview(buffer).cast("B"), 0
+        while size < len(view) and (chunk := self._file.read(len(view) - size)):
+            view[size : size + len(chunk)] = chunk
+            size += len(chunk)
+        return size
+
+
+def _decompressed(file: IO[bytes]) -> IO[bytes]:
+    return gzip.GzipFile(fileobj=file, mode="rb") if bgzf.is_gzip(file) else file
+
+
+def _skip_bytes(file: IO[bytes], size: int, chunk_size: int = 2**20) -> None:
+    if file.seekable():
+        file.seek(size)
+        return
+    # Streams from remotes are skipped without parsing.
+    while size > 0 and (chunk := file.read(min(size, chunk_size))):
+        size -= len(chunk)
+
+
+class EvenShards:
+    """
+    Stop iteration on every rank as soon as any rank runs out of batches.
+
+    Shards of an iterable dataset may differ by a batch, and a rank running an extra step
+    would wait forever for gradients of the others. It should be the outermost wrapper
+    of a loader as it runs a collective on every step.
+    """
+
+    def __init__(self, loader: Iterable[Any]) -> None:
+        self.loader = loader
+
+    def __len__(self) -> int:
+        return len(self.loader)  # type: ignore[arg-type]
+
+    def __iter__(self) -> Iterator[Any]:
+        batches = iter(self.loader)
+        while True:
+            batch = next(batches, None)
+            has_batch = torch.tensor(int(batch is not None))
+            dist.all_reduce(has_batch, op=dist.ReduceOp.MIN)
+            if has_batch.item() == 0:
+                return
+            yield batch
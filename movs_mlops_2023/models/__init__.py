@@ -1 +1,3 @@
+from movs_mlops_2023.models.ensemble import ClassificationEnsemble
 from movs_mlops_2023.models.model import Classification
+from movs_mlops_2023.models.optim import LazyAdam
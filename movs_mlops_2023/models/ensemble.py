@@ -0,0 +1,79 @@
+import torch
+
+from movs_mlops_2023.models.model import Classification, sparse_linear
+
+REDUCTIONS = ("mean", "vote")
+
+
+class ClassificationEnsemble(torch.nn.Module):
+    """
+    Score a batch with several Classification models of the same shape at once.
+
+    Weights of members are stacked, so the first layer of all members is a single matmul
+    (or a single sparse lookup) and the second one is a batched matmul.
+    Predictions are averaged probabilities or shares of member votes
+    (ties go to the lower label).
+    """
+
+    def __init__(self, members: list[Classification], reduction: str = "mean") -> None:
+        if reduction not in REDUCTIONS:
+            raise ValueError(
+                f"Unknown reduction {reduction}. Choose one of {', '.join(REDUCTIONS)}."
+            )
+        if len(members) == 0:
+            raise ValueError("Ensemble needs at least one member")
+        super().__init__()
+        states = [m.state_dict() for m in members]
+        shapes = {tuple((k, v.shape) for k, v in s.items()) for s in states}
+        if len(shapes) > 1 or len({m.sparse for m in members}) > 1:
+            raise ValueError("Ensemble members should have the same shape")
+        self.sparse = members[0].sparse
+        # [in_features, size * hidden_dim], sparse layers keep their weights transposed.
+        self.hidden_weight = torch.nn.Parameter(
+            torch.cat([s["_model.0.weight"] for s in states], dim=1)
+            if self.sparse
+            else torch.cat([s["_model.0.weight"] for s in states]).t().contiguous(),
+            requires_grad=False,
+        )
+        hidden_dim = self.hidden_weight.size(1) // len(states)
+        self.hidden_bias = torch.nn.Parameter(
+            torch.cat([s["_model.0.bias"] for s in states]), requires_grad=False
+        )
+        # [size, hidden_dim, num_classes]
+        self.out_weight = torch.nn.Parameter(
+            torch.stack([s["_model.2.weight"].t() for s in states]), requires_grad=False
+        )
+        self.out_bias = torch.nn.Parameter(
+            torch.stack([s["_model.2.bias"] for s in states]).unsqueeze(1), requires_grad=False
+        )
+        self.size, self.hidden_dim, self.reduction = len(states), hidden_dim, reduction
+
+    def forward(self, inputs: dict[str, torch.Tensor]) -> dict[str, torch.Tensor]:
+        if self.sparse:
+            hidden = sparse_linear(
+                inputs["features_indices"],
+                inputs["features_values"],
+                inputs["features_offsets"],
+                self.hidden_weight,
+                self.hidden_bias,
+            ).tanh()
+        else:
+            hidden = torch.addmm(self.hidden_bias, inputs["features"], self.hidden_weight).tanh()
+        # [size, batch_size, hidden_dim]
+        hidden = hidden.view(-1, self.size, self.hidden_dim).transpose(0, 1)
+        member_probs = torch.baddbmm(self.out_bias, hidden, self.out_weight).softmax(dim=-1)
+        if self.reduction == "mean":
+            probs = member_probs.mean(dim=0)
+        else:
+            votes = torch.nn.functional.one_hot(
+                member_probs.argmax(dim=-1), member_probs.size(-1)
+            ).sum(dim=0)
+            probs = votes.to(member_probs.dtype) / self.size
+        output_dict = {
+            "logits": probs.log(),
+            "probs": probs,
+            "member_probs": member_probs.transpose(0, 1),
+        }
+        if (target := inputs.get("target")) is not None and self.reduction == "mean":
+            output_dict["loss"] = torch.nn.functional.nll_loss(output_dict["logits"], target)
+        return output_dict
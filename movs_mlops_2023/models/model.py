@@ -1,19 +1,100 @@
+import math
+
 import torch
 
 
+class SparseLinear(torch.nn.Module):
+    """
+    Linear layer over sparse rows packed by the collator into indices, values and CSR offsets.
+
+    Only rows of the weight for present indices are read, so compute and activations
+    are proportional to the number of non-zeros. The weight is stored as
+    [in_features, out_features] like the one of EmbeddingBag and gets sparse gradients,
+    which need an optimizer like LazyAdam.
+    """
+
+    def __init__(self, in_features: int, out_features: int) -> None:
+        super().__init__()
+        self.weight = torch.nn.Parameter(torch.empty(in_features, out_features))
+        self.bias = torch.nn.Parameter(torch.empty(out_features))
+        # The same initialization as Linear.
+        bound = 1 / math.sqrt(in_features)
+        torch.nn.init.uniform_(self.weight, -bound, bound)
+        torch.nn.init.uniform_(self.bias, -bound, bound)
+
+    def forward(
+        self, indices: torch.Tensor, values: torch.Tensor, offsets: torch.Tensor
+    ) -> torch.Tensor:
+        return sparse_linear(indices, values, offsets, self.weight, self.bias, sparse=True)
+
+
 class Classification(torch.nn.Module):
-    def __init__(self, in_features: int, num_classes: int, hidden_dim: int = 100) -> None:
+    def __init__(
+        self, in_features: int, num_classes: int, hidden_dim: int = 100, sparse: bool = False
+    ) -> None:
         super().__init__()
+        self.sparse = sparse
         self._model = torch.nn.Sequential(
-            torch.nn.Linear(in_features=in_features, out_features=hidden_dim),
+            SparseLinear(in_features, hidden_dim)
+            if sparse
+            else torch.nn.Linear(in_features=in_features, out_features=hidden_dim),
             torch.nn.Tanh(),
             torch.nn.Linear(in_features=hidden_dim, out_features=num_classes),
         )
         self._loss = torch.nn.CrossEntropyLoss()
 
     def forward(self, inputs: dict[str, torch.Tensor]) -> dict[str, torch.Tensor]:
-        logits = self._model(inputs["features"])
+        if self.sparse:
+            hidden = self._model[0](
+                inputs["features_indices"], inputs["features_values"], inputs["features_offsets"]
+            )
+            logits = self._model[1:](hidden)
+        else:
+            logits = self._model(inputs["features"])
         output_dict = {"logits": logits, "probs": logits.softmax(dim=-1)}
         if (target := inputs.get("target")) is not None:
             output_dict["loss"] = self._loss(logits, target)
         return output_dict
+
+
+def sparse_linear(
+    indices: torch.Tensor,
+    values: torch.Tensor,
+    offsets: torch.Tensor,
+    weight: torch.Tensor,
+    bias: torch.Tensor | None = None,
+    sparse: bool = False,
+) -> torch.Tensor:
+    """
+    Multiply sparse rows by a weight of [in_features, out_features].
+
+    Parameters
+    ----------
+    indices: torch.Tensor
+        Indices of non-zeros of all rows one after another.
+    values: torch.Tensor
+        Values of non-zeros.
+    offsets: torch.Tensor
+        Offsets of rows in `indices` with the total number of non-zeros at the end (CSR).
+    weight: torch.Tensor
+        Weight of [in_features, out_features].
+    bias: torch.Tensor | None (default = None)
+        Bias of [out_features].
+    sparse: bool (default = False)
+        Whether the gradient of the weight is sparse with the rows of present indices only.
+
+    Returns
+    -------
+    torch.Tensor
+        Output of [batch_size, out_features].
+    """
+    output = torch.nn.functional.embedding_bag(
+        indices,
+        weight,
+        offsets,
+        mode="sum",
+        per_sample_weights=values.to(weight.dtype),
+        include_last_offset=True,
+        sparse=sparse,
+    )
+    return output + bias if bias is not None else output
@@ -0,0 +1,83 @@
+from typing import Any, Callable, Iterable
+import math
+
+import torch
+
+
+class LazyAdam(torch.optim.Optimizer):
+    """
+    Adam that updates only rows present in sparse gradients.
+
+    Parameters with dense gradients are updated like with Adam. For sparse gradients,
+    like the ones of SparseLinear, moments and weights are read and written only for rows
+    in the batch, as in SparseAdam, so a step costs as much as the number of non-zeros
+    instead of the size of the weight.
+    """
+
+    def __init__(
+        self,
+        params: Iterable[Any],
+        lr: float = 1e-3,
+        betas: tuple[float, float] = (0.9, 0.999),
+        eps: float = 1e-8,
+    ) -> None:
+        super().__init__(params, {"lr": lr, "betas": betas, "eps": eps})
+
+    @torch.no_grad()
+    def step(self, closure: Callable[[], float] | None = None) -> float | None:
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+        for group in self.param_groups:
+            for param in group["params"]:
+                if param.grad is None:
+                    continue
+                state = self.state[param]
+                if len(state) == 0:
+                    state["step"] = 0
+                    state["exp_avg"] = torch.zeros_like(param)
+                    state["exp_avg_sq"] = torch.zeros_like(param)
+                state["step"] += 1
+                if param.grad.is_sparse:
+                    _sparse_update(param, state, **group)
+                else:
+                    _dense_update(param, state, **group)
+        return loss
+
+
+def _dense_update(
+    param: torch.Tensor,
+    state: dict[str, Any],
+    lr: float,
+    betas: tuple[float, float],
+    eps: float,
+    **_: Any,
+) -> None:
+    (beta1, beta2), grad = betas, param.grad
+    state["exp_avg"].lerp_(grad, 1 - beta1)
+    state["exp_avg_sq"].mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+    bias_correction1 = 1 - beta1 ** state["step"]
+    bias_correction2_sqrt = math.sqrt(1 - beta2 ** state["step"])
+    denom = (state["exp_avg_sq"].sqrt() / bias_correction2_sqrt).add_(eps)
+    param.addcdiv_(state["exp_avg"], denom, value=-lr / bias_correction1)
+
+
+def _sparse_update(
+    param: torch.Tensor,
+    state: dict[str, Any],
+    lr: float,
+    betas: tuple[float, float],
+    eps: float,
+    **_: Any,
+) -> None:
+    (beta1, beta2), grad = betas, param.grad.coalesce()
+    rows, values = grad.indices()[0], grad.values()
+    exp_avg = state["exp_avg"][rows].lerp_(values, 1 - beta1)
+    exp_avg_sq = state["exp_avg_sq"][rows].mul_(beta2).addcmul_(values, values, value=1 - beta2)
+    state["exp_avg"][rows] = exp_avg
+    state["exp_avg_sq"][rows] = exp_avg_sq
+    bias_correction1 = 1 - beta1 ** state["step"]
+    bias_correction2_sqrt = math.sqrt(1 - beta2 ** state["step"])
+    denom = (exp_avg_sq.sqrt_() / bias_correction2_sqrt).add_(eps)
+    param.index_add_(0, rows, exp_avg.div_(denom), alpha=-lr / bias_correction1)
@@ -0,0 +1,31 @@
+from io import BufferedReader, BufferedWriter
+import shutil
+
+import click
+
+from movs_mlops_2023.datasets import bgzf
+
+
+@click.command(
+    help=(
+        "Compress JSON lines into BGZF blocks of whole lines "
+        "that DataLoader workers decompress in parallel."
+    ),
+    context_settings={"help_option_names": ["-h", "--help"]},
+)
+@click.argument("path", type=click.File("rb"), default="-")
+@click.option("--compresslevel", type=click.IntRange(1, 9), default=6, show_default=True)
+@click.option(
+    "-o",
+    "--out",
+    type=click.File("wb"),
+    help="Output file. By default prints to stdout.",
+    default="-",
+)
+def main(path: BufferedReader, out: BufferedWriter, compresslevel: int = 6) -> None:
+    with bgzf.Writer(out, compresslevel=compresslevel) as writer:
+        shutil.copyfileobj(path, writer, bgzf.BLOCK_SIZE)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
-from io import TextIOWrapper
+from contextlib import nullcontext
+from io import BufferedWriter
 import json
 
 import click
@@ -6,6 +7,8 @@ import numpy as np
 from sklearn.datasets import make_classification
 from sklearn.model_selection import train_test_split
 
+from movs_mlops_2023.datasets import bgzf
+
 
 @click.command(
     help="Generate dataset",
@@ -17,15 +20,22 @@ from sklearn.model_selection import train_test_split
 @click.option("--n-classes", type=click.INT, default=10, show_default=True)
 @click.option("--test-size", type=click.FLOAT, default=0.2, show_default=True)
 @click.option("--seed", type=click.INT, default=13, show_default=True)
+@click.option(
+    "--bgzf",
+    "compress",
+    is_flag=True,
+    help="Compress into BGZF, gzip blocks of whole lines that DataLoader workers read in parallel.",
+)
 @click.option(
     "-o",
     "--out",
-    type=click.File("w", encoding="utf-8"),
+    type=click.File("wb"),
     help="Output file. By default prints to stdout.",
     default="-",
 )
 def main(
-    out: TextIOWrapper,
+    out: BufferedWriter,
+    compress: bool = False,
     n_samples: int = 100_000,
     n_features: int = 50,
     n_informative: int = 13,
@@ -43,20 +53,14 @@ def main(
     train_features, eval_features, train_target, eval_target = train_test_split(
         features, target, test_size=test_size, random_state=seed
     )
-    for f, t in zip(train_features, train_target, strict=True):
-        json.dump(
-            {"features": f.astype(np.float32).tolist(), "target": int(t), "part": "train"},
-            out,
-            ensure_ascii=False,
-        )
-        out.write("\n")
-    for f, t in zip(eval_features, eval_target, strict=True):
-        json.dump(
-            {"features": f.astype(np.float32).tolist(), "target": int(t), "part": "eval"},
-            out,
-            ensure_ascii=False,
-        )
-        out.write("\n")
+    with bgzf.Writer(out) if compress else nullcontext(out) as writer:
+        for part, part_features, part_target in (
+            ("train", train_features, train_target),
+            ("eval", eval_features, eval_target),
+        ):
+            for f, t in zip(part_features, part_target, strict=True):
+                record = {"features": f.astype(np.float32).tolist(), "target": int(t), "part": part}
+                writer.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
 
 
 if __name__ == "__main__":
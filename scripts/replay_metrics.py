@@ -0,0 +1,24 @@
+from pathlib import Path
+
+import click
+
+
+@click.command(
+    help="Replay params and metrics written by train.py --metrics-file into a new MLflow run.",
+    context_settings={"help_option_names": ["-h", "--help"]},
+)
+@click.argument("path", type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.option("--mlflow-uri", type=click.STRING, default="http://128.0.1.1:8080", show_default=True)
+@click.option("--run-name", type=click.STRING, help="Run name. Defaults to the one in the file.")
+def main(path: Path, mlflow_uri: str, run_name: str | None = None) -> None:
+    import mlflow
+
+    from experiments.trackers import replay_to_mlflow
+
+    mlflow.set_tracking_uri(uri=mlflow_uri)
+    run_id = replay_to_mlflow(path, run_name=run_name)
+    click.echo(f"Replayed {path} into run {run_id}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+from typing import IO, Callable
+import io
+
+import pytest
+
+
+class _Stream(io.RawIOBase):
+    """Non-seekable stream that returns at most a few bytes on every read, like sockets."""
+
+    def __init__(self, data: bytes, chunk_size: int = 5) -> None:
+        super().__init__()
+        self._file = io.BytesIO(data)
+        self._chunk_size = chunk_size
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: memoryview) -> int:
+        chunk = self._file.read(min(len(buffer), self._chunk_size))
+        buffer[: len(chunk)] = chunk
+        return len(chunk)
+
+
+@pytest.fixture()
+def stream() -> Callable[[bytes], IO[bytes]]:
+    """Open bytes as a buffered non-seekable stream."""
+    return lambda data: io.BufferedReader(_Stream(data))
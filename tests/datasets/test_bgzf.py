@@ -0,0 +1,87 @@
+from typing import IO
+import gzip
+import io
+import json
+
+import pytest
+
+from movs_mlops_2023.datasets import bgzf
+
+DATA = b"".join(json.dumps({"id": i, "text": "x" * (i % 7)}).encode() + b"\n" for i in range(23))
+
+
+def compress(data: bytes, block_size: int = 64) -> bytes:
+    file = io.BytesIO()
+    with bgzf.Writer(file, block_size=block_size) as writer:
+        writer.write(data)
+    return file.getvalue()
+
+
+def read_blocks(file: IO[bytes]) -> list[tuple[int, int, bytes]]:
+    return [(offset, size, read()) for offset, size, read in bgzf.blocks(file)]
+
+
+def test_writer_output_is_gzip():
+    file = io.BytesIO()
+    with bgzf.Writer(file, block_size=64) as writer:
+        writer.write(DATA)
+    assert not file.closed
+    assert file.getvalue().endswith(bgzf.EOF_BLOCK)
+    assert gzip.decompress(file.getvalue()) == DATA
+
+
+def test_writer_keeps_whole_lines_in_blocks():
+    *blocks, eof = read_blocks(io.BytesIO(data := compress(DATA)))
+    assert all(0 < len(block) <= 64 and block.endswith(b"\n") for _, _, block in blocks)
+    assert b"".join(block for _, _, block in blocks) == DATA
+    assert [offset for offset, _, _ in blocks] == [
+        sum(size for _, size, _ in blocks[:i]) for i in range(len(blocks))
+    ]
+    assert eof == (len(data) - len(bgzf.EOF_BLOCK), len(bgzf.EOF_BLOCK), b"")
+
+
+def test_writer_rejects_lines_longer_than_blocks():
+    with pytest.raises(ValueError, match="Lines longer than 64 bytes"):
+        bgzf.Writer(io.BytesIO(), block_size=64).write(b"x" * 64 + b"\n")
+
+
+@pytest.mark.parametrize(
+    "data, gzipped, blocked",
+    [
+        (compress(DATA), True, True),
+        (gzip.compress(DATA), True, False),
+        (DATA, False, False),
+        (b"", False, False),
+    ],
+    ids=["bgzf", "gzip", "plain", "empty"],
+)
+def test_format_detection_does_not_move_files(data, gzipped, blocked):
+    file = io.BytesIO(data)
+    assert bgzf.is_gzip(file) == gzipped
+    assert bgzf.is_bgzf(file) == blocked
+    assert file.read() == data
+
+
+def test_blocks_of_streams_match_seekable_files(stream):
+    data = compress(DATA)
+    assert read_blocks(stream(data)) == read_blocks(io.BytesIO(data))
+
+
+def test_read_block_at_offsets():
+    file = io.BytesIO(compress(DATA))
+    for offset, _, block in read_blocks(io.BytesIO(file.getvalue())):
+        assert bgzf.read_block(file, offset) == block
+
+
+def test_corrupted_blocks_are_rejected():
+    data = bytearray(compress(DATA))
+    _, size, _ = next(bgzf.blocks(io.BytesIO(data)))
+    # Flip a bit of the crc32 of the first block.
+    data[size - 8] ^= 1
+    with pytest.raises(ValueError, match="is corrupted"):
+        bgzf.read_block(io.BytesIO(data), 0)
+
+
+def test_blocks_reject_other_formats():
+    with pytest.raises(ValueError, match="No BGZF block at offset 0"):
+        read_blocks(io.BytesIO(gzip.compress(DATA)))
@@ -0,0 +1,28 @@
+from accelerate import Accelerator
+import torch
+from torch.utils.data import DataLoader
+
+from movs_mlops_2023.datasets.preload import Preloaded
+
+SAMPLES = [{"x": torch.tensor(i)} for i in range(64)]
+
+
+def order(loader: Preloaded) -> list[int]:
+    return [x for batch in loader for x in batch["x"].tolist()]
+
+
+def test_preloaded_shuffles_prepared_loaders():
+    generator = torch.Generator().manual_seed(13)
+    loader = Accelerator(cpu=True).prepare_data_loader(
+        DataLoader(SAMPLES, batch_size=8, shuffle=True, generator=generator)
+    )
+    preloaded = Preloaded(loader, generator=torch.Generator().manual_seed(13))
+    first, second = order(preloaded), order(preloaded)
+    assert sorted(first) == sorted(second) == list(range(64))
+    assert first != second
+
+
+def test_preloaded_keeps_order_of_sequential_loaders():
+    loader = Accelerator(cpu=True).prepare_data_loader(DataLoader(SAMPLES, batch_size=8))
+    preloaded = Preloaded(loader)
+    assert order(preloaded) == order(preloaded) == list(range(64))
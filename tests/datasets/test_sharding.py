@@ -0,0 +1,285 @@
+from typing import IO, Callable
+import gzip
+import io
+from itertools import accumulate
+import json
+from pathlib import Path
+import random
+
+import pytest
+
+from movs_mlops_2023.datasets import bgzf
+from movs_mlops_2023.datasets.jsonl import Iter
+from movs_mlops_2023.datasets.sharding import (
+    POSITION_KEY,
+    VIRTUAL_SHIFT,
+    ShardedLines,
+    _sample_block_lines,
+    _sample_lines,
+    read_block_shard,
+    read_shard,
+)
+
+LINES = [json.dumps({"id": i, "text": "x" * (i % 7)}).encode() + b"\n" for i in range(23)]
+DATA = b"".join(LINES)
+# Offsets of line beginnings, the last one is the end of data.
+STARTS = [0, *accumulate(map(len, LINES))]
+
+
+def compress(data: bytes, block_size: int = 64) -> bytes:
+    file = io.BytesIO()
+    with bgzf.Writer(file, block_size=block_size) as writer:
+        writer.write(data)
+    return file.getvalue()
+
+
+BLOCKED = compress(DATA)
+# Offsets, sizes and data of blocks without the empty block at the end.
+BLOCKS = [(offset, size, read()) for offset, size, read in bgzf.blocks(io.BytesIO(BLOCKED))][:-1]
+
+
+class Lines(ShardedLines):
+    def __init__(self, open_file: Callable[[], IO[bytes]], track_position: bool = False) -> None:
+        super().__init__(track_position=track_position)
+        self._open_file = open_file
+
+    @property
+    def source(self) -> str:
+        return "memory"
+
+    def _open(self) -> IO[bytes]:
+        return self._open_file()
+
+
+def write_dataset(path: Path, data: bytes = DATA) -> Path:
+    path.write_bytes(data)
+    return path
+
+
+@pytest.mark.parametrize("step", [1, 2, 3])
+def test_read_shard_splits_lines(step):
+    shards = [[line for _, line in read_shard(io.BytesIO(DATA), i, step)] for i in range(step)]
+    assert shards == [LINES[i::step] for i in range(step)]
+
+
+def test_read_shard_yields_offsets_after_lines():
+    assert [offset for offset, _ in read_shard(io.BytesIO(DATA), 0, 1)] == STARTS[1:]
+
+
+@pytest.mark.parametrize("step", [1, 2, 3])
+@pytest.mark.parametrize("seekable", [True, False])
+def test_read_shard_resumes_after_every_line(stream, step, seekable):
+    for index in range(step):
+        shard = list(read_shard(io.BytesIO(DATA), index, step))
+        for consumed, (offset, _) in enumerate(shard, start=1):
+            file = io.BytesIO(DATA) if seekable else stream(DATA)
+            rest = read_shard(file, index, step, offset=offset)
+            assert list(rest) == shard[consumed:]
+
+
+@pytest.mark.parametrize("world_size", [1, 2, 3])
+def test_iter_resumes_from_positions(tmp_path, monkeypatch, world_size):
+    path = write_dataset(tmp_path / "train.jsonl")
+    monkeypatch.setenv("WORLD_SIZE", str(world_size))
+    for rank in range(world_size):
+        monkeypatch.setenv("RANK", str(rank))
+        dataset = Iter(path, track_position=True)
+        samples = list(dataset)
+        assert [s["id"] for s in samples] == list(range(rank, len(LINES), world_size))
+        for consumed, sample in enumerate(samples, start=1):
+            index, num_shards, offset = sample[POSITION_KEY]
+            dataset.resume({index: offset}, num_shards=num_shards)
+            assert list(dataset) == samples[consumed:]
+        # Offsets are used for one pass only.
+        assert list(dataset) == samples
+
+
+def test_iter_rejects_positions_of_other_shards(tmp_path, monkeypatch):
+    monkeypatch.setenv("RANK", "0")
+    monkeypatch.setenv("WORLD_SIZE", "2")
+    dataset = Iter(write_dataset(tmp_path / "train.jsonl"), track_position=True)
+    dataset.resume({0: len(LINES[0])}, num_shards=1)
+    with pytest.raises(RuntimeError, match="Can not resume 1 shards with 2 shards"):
+        list(dataset)
+
+
+@pytest.mark.parametrize("step", [1, 2, 3])
+def test_read_shard_reads_lines_between_start_and_stop(step):
+    # Shards count lines from start and the line crossing stop is skipped.
+    start, stop = STARTS[5], STARTS[15] + 3
+    shards = [read_shard(io.BytesIO(DATA), i, step, start=start, stop=stop) for i in range(step)]
+    assert [[line for _, line in shard] for shard in shards] == [
+        LINES[5 + i : 15 : step] for i in range(step)
+    ]
+
+
+@pytest.mark.parametrize("offset", [None, 0, STARTS[5]])
+def test_read_shard_ignores_offsets_before_start(offset):
+    lines = read_shard(io.BytesIO(DATA), 0, 1, offset=offset, start=STARTS[5])
+    assert [line for _, line in lines] == LINES[5:]
+
+
+def test_iter_skips_rows_appended_after_stop(tmp_path):
+    path = write_dataset(tmp_path / "train.jsonl")
+    dataset = Iter(path)
+    dataset.select(STARTS[5], len(DATA))
+    with path.open("ab") as file:
+        file.write(b'{"id": 100, "text": ""}\n')
+    assert [s["id"] for s in dataset] == list(range(5, len(LINES)))
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_sample_lines_takes_distinct_lines_before_stop(seed):
+    lines = _sample_lines(io.BytesIO(DATA), STARTS[10], 6, random.Random(seed))
+    assert 0 < len(lines) <= 6
+    assert len(set(lines)) == len(lines)
+    assert set(lines) <= set(LINES[:10])
+    assert lines == _sample_lines(io.BytesIO(DATA), STARTS[10], 6, random.Random(seed))
+
+
+def test_sample_lines_takes_every_line_of_small_ranges():
+    assert sorted(_sample_lines(io.BytesIO(DATA), STARTS[3], 1000, random.Random(0))) == sorted(
+        LINES[:3]
+    )
+
+
+@pytest.mark.parametrize("world_size", [1, 2, 3])
+def test_iter_replays_the_same_lines_before_start(tmp_path, monkeypatch, world_size):
+    path = write_dataset(tmp_path / "train.jsonl")
+    monkeypatch.setenv("WORLD_SIZE", str(world_size))
+    new, replayed = [], []
+    for rank in range(world_size):
+        monkeypatch.setenv("RANK", str(rank))
+        dataset = Iter(path)
+        dataset.select(STARTS[10], replay=6, seed=3)
+        ids = [s["id"] for s in dataset]
+        assert [s["id"] for s in dataset] == ids
+        new.append([i for i in ids if i >= 10])
+        replayed.extend(i for i in ids if i < 10)
+    assert new == [list(range(10 + rank, len(LINES), world_size)) for rank in range(world_size)]
+    assert 0 < len(replayed) <= 6
+    assert len(set(replayed)) == len(replayed)
+
+
+@pytest.mark.parametrize("world_size", [1, 2, 3])
+def test_iter_resumes_with_replay(tmp_path, monkeypatch, world_size):
+    path = write_dataset(tmp_path / "train.jsonl")
+    monkeypatch.setenv("WORLD_SIZE", str(world_size))
+    for rank in range(world_size):
+        monkeypatch.setenv("RANK", str(rank))
+        dataset = Iter(path, track_position=True)
+        dataset.select(STARTS[10], replay=6, seed=3)
+        samples = list(dataset)
+        for sample in samples:
+            index, num_shards, offset = sample[POSITION_KEY]
+            dataset.resume({index: offset}, num_shards=num_shards)
+            # Replayed lines share positions with new lines before them.
+            assert list(dataset) == [s for s in samples if s[POSITION_KEY][2] > offset]
+
+
+def test_iter_replay_needs_seekable_files(tmp_path):
+    dataset = Iter(write_dataset(tmp_path / "train.jsonl.gz", gzip.compress(DATA)))
+    dataset.select(STARTS[10], replay=6)
+    with pytest.raises(RuntimeError, match="Replay needs a seekable plain or BGZF file"):
+        list(dataset)
+
+
+def test_size_of_plain_and_gzip_files(tmp_path):
+    plain = Iter(write_dataset(tmp_path / "train.jsonl"))
+    assert plain.known_size() == plain.size() == len(DATA)
+    compressed = Iter(write_dataset(tmp_path / "train.jsonl.gz", gzip.compress(DATA)))
+    assert compressed.known_size() is None
+    assert compressed.size() == len(DATA)
+
+
+@pytest.mark.parametrize("step", [1, 2, 3])
+def test_read_block_shard_splits_blocks(step):
+    for index in range(step):
+        lines = [line for _, line in read_block_shard(io.BytesIO(BLOCKED), index, step)]
+        assert b"".join(lines) == b"".join(block for _, _, block in BLOCKS[index::step])
+
+
+def test_read_block_shard_yields_virtual_offsets_after_lines():
+    expected = []
+    for offset, size, block in BLOCKS:
+        ends = list(accumulate(map(len, io.BytesIO(block))))
+        # The end of a block is the beginning of the next one.
+        expected += [offset << VIRTUAL_SHIFT | end for end in ends[:-1]]
+        expected.append((offset + size) << VIRTUAL_SHIFT)
+    assert [offset for offset, _ in read_block_shard(io.BytesIO(BLOCKED), 0, 1)] == expected
+
+
+@pytest.mark.parametrize("step", [1, 2, 3])
+@pytest.mark.parametrize("seekable", [True, False])
+def test_read_block_shard_resumes_after_every_line(stream, step, seekable):
+    for index in range(step):
+        shard = list(read_block_shard(io.BytesIO(BLOCKED), index, step))
+        for consumed, (offset, _) in enumerate(shard, start=1):
+            file = io.BytesIO(BLOCKED) if seekable else stream(BLOCKED)
+            rest = read_block_shard(file, index, step, offset=offset)
+            assert list(rest) == shard[consumed:]
+
+
+@pytest.mark.parametrize("step", [1, 2, 3])
+def test_read_block_shard_reads_blocks_between_start_and_stop(step):
+    # Shards count blocks from start and the block crossing stop is skipped.
+    start, stop = BLOCKS[2][0], BLOCKS[6][0] + 3
+    for index in range(step):
+        lines = read_block_shard(io.BytesIO(BLOCKED), index, step, start=start, stop=stop)
+        assert b"".join(line for _, line in lines) == b"".join(
+            block for _, _, block in BLOCKS[2 + index : 6 : step]
+        )
+
+
+def test_read_block_shard_rejects_blocks_with_parts_of_lines():
+    data = compress(DATA[:10])
+    with pytest.raises(ValueError, match="does not end with a whole line"):
+        list(read_block_shard(io.BytesIO(data), 0, 1))
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_sample_block_lines_takes_distinct_lines_before_stop(seed):
+    stop = BLOCKS[4][0]
+    before = b"".join(block for _, _, block in BLOCKS[:4])
+    lines = _sample_block_lines(io.BytesIO(BLOCKED), stop, 6, random.Random(seed))
+    assert 0 < len(lines) <= 6
+    assert len(set(lines)) == len(lines)
+    assert set(lines) <= set(io.BytesIO(before))
+    assert lines == _sample_block_lines(io.BytesIO(BLOCKED), stop, 6, random.Random(seed))
+
+
+@pytest.mark.parametrize("world_size", [1, 2, 3])
+def test_bgzf_iter_resumes_with_replay(tmp_path, monkeypatch, world_size):
+    path = write_dataset(tmp_path / "train.jsonl.gz", BLOCKED)
+    monkeypatch.setenv("WORLD_SIZE", str(world_size))
+    first = len(list(io.BytesIO(b"".join(block for _, _, block in BLOCKS[:4]))))
+    new, replayed = [], []
+    for rank in range(world_size):
+        monkeypatch.setenv("RANK", str(rank))
+        dataset = Iter(path, track_position=True)
+        dataset.select(BLOCKS[4][0], replay=6, seed=3)
+        samples = list(dataset)
+        new.extend(s["id"] for s in samples if s["id"] >= first)
+        replayed.extend(s["id"] for s in samples if s["id"] < first)
+        for sample in samples:
+            index, num_shards, offset = sample[POSITION_KEY]
+            dataset.resume({index: offset}, num_shards=num_shards)
+            assert list(dataset) == [s for s in samples if s[POSITION_KEY][2] > offset]
+    assert sorted(new) == list(range(first, len(LINES)))
+    assert 0 < len(replayed) <= 6
+    assert len(set(replayed)) == len(replayed)
+
+
+def test_size_of_bgzf_files_counts_compressed_bytes(tmp_path):
+    dataset = Iter(write_dataset(tmp_path / "train.jsonl.gz", BLOCKED))
+    assert dataset.known_size() == dataset.size() == len(BLOCKED)
+
+
+@pytest.mark.parametrize(
+    "data", [DATA, gzip.compress(DATA), BLOCKED], ids=["plain", "gzip", "bgzf"]
+)
+def test_streams_are_read_like_seekable_files(stream, data):
+    seekable = Lines(lambda: io.BytesIO(data), track_position=True)
+    assert [s["id"] for s in seekable] == list(range(len(LINES)))
+    assert list(Lines(lambda: stream(data), track_position=True)) == list(seekable)
+    assert Lines(lambda: stream(data)).size() == seekable.size()
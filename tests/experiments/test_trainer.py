@@ -0,0 +1,61 @@
+from accelerate import Accelerator
+from ignite.engine import Events
+import pytest
+import torch
+
+from experiments.trainer import FastTrainer, Trainer, _concat, every_iterations
+from movs_mlops_2023.datasets.collator import Default
+
+
+class Model(torch.nn.Module):
+    def __init__(self) -> None:
+        super().__init__()
+        self.weight = torch.nn.Parameter(torch.zeros(1))
+
+    def forward(self, batch: dict[str, torch.Tensor]) -> dict[str, torch.Tensor]:
+        return {"loss": (self.weight - batch["x"]).pow(2).mean()}
+
+
+def make_trainer(fast_every: int) -> Trainer:
+    model = Model()
+    kwargs = {"optimizer": torch.optim.SGD(model.parameters(), lr=0.1)}
+    kwargs["accelerator"] = Accelerator(cpu=True)
+    if fast_every > 0:
+        return FastTrainer(model, every=fast_every, **kwargs)
+    return Trainer(model, **kwargs)
+
+
+@pytest.mark.parametrize(
+    "fast_every, expected",
+    [
+        (0, [30, 60, 90, 120]),
+        (1, [30, 60, 90, 120]),
+        # Events of 7 iterations each, epochs of 70 iterations end with an event.
+        (7, [35, 63, 91, 126]),
+        # Events at 50, 70, 120 and 140, the one at 120 passes both 90 and 120.
+        (50, [50, 70, 120]),
+    ],
+)
+def test_every_iterations_fires_after_every_multiple(fast_every, expected):
+    trainer, fired = make_trainer(fast_every), []
+    trainer.add_event(
+        "train",
+        Events.ITERATION_COMPLETED(event_filter=every_iterations(30)),
+        lambda engine: fired.append(engine.state.iteration),
+    )
+    batches = [{"x": torch.rand(4)} for _ in range(70)]
+    trainer.run({"train": batches}, max_iters={}, epochs=2)
+    assert fired == expected
+
+
+def test_concat_continues_offsets_of_sparse_batches():
+    rows = [
+        {"features": {"indices": list(range(i % 4)), "values": [float(i)] * (i % 4)}, "y": i}
+        for i in range(10)
+    ]
+    collator = Default()
+    batches = [collator(rows[start : start + 3]) for start in range(0, len(rows), 3)]
+    concatenated, expected = _concat(batches), collator(rows)
+    assert concatenated.keys() == expected.keys()
+    for key, tensor in expected.items():
+        assert torch.equal(concatenated[key], tensor), key
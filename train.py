@@ -1,25 +1,26 @@
+from typing import Any
 from pathlib import Path
 
 import click
-from hydra.utils import instantiate
-from jinja2 import StrictUndefined, Template
-import mlflow
-from mlflow.utils.git_utils import get_git_branch, get_git_commit
-from rich import print_json
-import torch
-import yaml
 
 from experiments.base import Experiment
 from experiments.click_options import (
     State,
+    artifact_store_option,
+    cache_dir_option,
     debug_option,
     dir_option,
     extra_vars_option,
+    force_option,
+    metrics_file_option,
     name_option,
     no_mlflow_option,
     pass_state,
+    resume_option,
     seed_option,
+    warm_start_option,
 )
+from experiments.utils import is_main_process, load_config
 
 
 @click.command(
@@ -38,44 +39,88 @@ from experiments.click_options import (
 @seed_option
 @debug_option
 @no_mlflow_option
+@metrics_file_option
 @extra_vars_option
+@cache_dir_option(".run-cache")
+@artifact_store_option(".artifact-store")
+@force_option
+@resume_option
+@warm_start_option
 @pass_state
 def main(state: State, config_path: Path) -> None:
-    with config_path.open("r", encoding="utf-8") as file:
-        tmpl = Template(file.read(), undefined=StrictUndefined, autoescape=True)
-        config = yaml.safe_load(tmpl.render(**(state.extra_vars or {})))
+    from rich import print_json
+
+    from experiments.artifacts import ArtifactStore
+    from experiments.cache import RunCache
+
+    config = load_config(config_path, extra_vars=state.extra_vars)
+    store = ArtifactStore(state.artifact_store) if state.artifact_store is not None else None
+    run_cache = RunCache(state.cache_dir, store=store)
+    # Warm-started runs depend on the previous run that is not a part of the fingerprint.
+    fingerprint = (
+        run_cache.fingerprint(config, seed=state.seed, debug=state.debug)
+        if state.warm_start is None
+        else None
+    )
+    restore_dir = state.exp_dir if is_main_process() else None
+    if (
+        not state.force
+        and fingerprint is not None
+        and not state.resume
+        and (metrics := run_cache.restore(fingerprint, restore_dir)) is not None
+    ):
+        print_json(data=metrics)
+        return
+
+    from hydra.utils import instantiate
+    import torch
+
     if state.exp_dir is not None:
         state.exp_dir.mkdir(exist_ok=True)
-    if state.use_mlflow:
-        mlflow.set_tracking_uri(uri=config["mlflow_uri"])
     exp: Experiment = instantiate(
         config.pop("experiment"),
         exp_config=lambda: config,
         dir=state.exp_dir,
         debug=state.debug,
         seed=state.seed,
-        trackers_params=(
-            {
-                "mlflow": {
-                    "run_name": state.exp_name,
-                    "tags": {
-                        "commit": get_git_commit(Path.cwd()),
-                        "branch": get_git_branch(Path.cwd()),
-                    },
-                },
-            }
-            if state.use_mlflow
-            else {}
-        ),
+        resume=state.resume,
+        warm_start=state.warm_start,
+        artifact_store=store,
+        trackers_params=trackers_params(state, mlflow_uri=config["mlflow_uri"]),
     )
     _ = exp.run()
-    print_json(
-        data={
-            metric: value.item() if isinstance(value, torch.Tensor) else value
-            for metric, value in exp.metrics.items()
-            if not metric.startswith("_")
-        }
-    )
+    metrics = {
+        metric: value.item() if isinstance(value, torch.Tensor) else value
+        for metric, value in exp.metrics.items()
+        if not metric.startswith("_")
+    }
+    if is_main_process() and fingerprint is not None:
+        run_cache.save(fingerprint, metrics, state.exp_dir)
+    print_json(data=metrics)
+
+
+def trackers_params(state: State, mlflow_uri: str) -> dict[str, Any]:
+    params = mlflow_params(state, uri=mlflow_uri) if state.use_mlflow else {}
+    if state.metrics_file is not None:
+        params["file"] = {"path": state.metrics_file, "run_name": state.exp_name}
+    return params
+
+
+def mlflow_params(state: State, uri: str) -> dict[str, Any]:
+    # mlflow takes seconds to import so we only pay for it when it is enabled.
+    import mlflow
+    from mlflow.utils.git_utils import get_git_branch, get_git_commit
+
+    mlflow.set_tracking_uri(uri=uri)
+    return {
+        "mlflow": {
+            "run_name": state.exp_name,
+            "tags": {
+                "commit": get_git_commit(Path.cwd()),
+                "branch": get_git_branch(Path.cwd()),
+            },
+        },
+    }
 
 
 if __name__ == "__main__":